@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""Benchmark index builds on synthetic notebooks.
+
+Run from the repository root::
+
+    python benchmarks/bench_build.py --sizes 1000 10000 --output new.json
+    python benchmarks/bench_build.py --compare new.json --output newer.json
+
+Each phase is timed over --runs runs (median) and then run once more under
+tracemalloc for its peak memory. The build phase runs the console script in
+a child process and reports its maximum resident set size instead, as does
+build_stream for build --stream.
+"""
+import argparse
+import dataclasses
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import generate
+from sphinx_notebook import notebook
+
+SIZES = [1000, 10000, 100000]
+
+
+def measure(func, runs):
+    """Return median milliseconds, peak KiB and the result of func."""
+    times = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'time_ms': round(statistics.median(times), 2),
+        'peak_kib': peak // 1024
+    }, result
+
+
+def measure_build(root_dir, runs, *options):
+    """Return median milliseconds and max RSS KiB of the build command."""
+    times = []
+    max_rss = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args = [
+            sys.executable, '-m', 'sphinx_notebook.cli', 'build', *options,
+            str(root_dir), f'{tmp}/index.rst'
+        ]
+
+        for _ in range(runs):
+            Path(tmp, 'index.rst').unlink(missing_ok=True)
+            start = time.perf_counter()
+            with subprocess.Popen(args,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL) as process:
+                # wait4 reports the resource usage of the child alone
+                _, status, usage = os.wait4(process.pid, 0)
+                process.returncode = status
+
+            times.append((time.perf_counter() - start) * 1000)
+
+            if status:
+                raise subprocess.CalledProcessError(status, args)
+
+            max_rss = max(max_rss, usage.ru_maxrss)
+
+    return {'time_ms': round(statistics.median(times), 2), 'peak_kib': max_rss}
+
+
+def bench(root_dir, runs):
+    """Return results of each phase for one notebook."""
+    results = {}
+    template = notebook.get_environment().get_template('index.rst.jinja')
+
+    results['get_notes'], (notes, meta_data) = measure(
+        lambda: notebook.get_notes(root_dir), runs)
+    results['to_tree'], root = measure(
+        lambda: notebook.to_tree(notes, meta_data), runs)
+
+    index_meta = notebook.get_index_meta(meta_data)
+    results['render_index'], _ = measure(
+        lambda: notebook.render_index(root, index_meta.title, index_meta.
+                                      header, template, io.StringIO()), runs)
+    results['build'] = measure_build(root_dir, runs)
+    results['build_stream'] = measure_build(root_dir, runs, '--stream')
+
+    return results
+
+
+def get_notebook(work_dir, size, shape):
+    """Return a generated notebook, reusing one from an earlier run."""
+    key = '-'.join(
+        f'{x}={y}' for x, y in sorted(dataclasses.asdict(shape).items()))
+    root_dir = Path(work_dir) / f'notes={size}-{key}'
+
+    if not root_dir.exists():
+        partial = root_dir.with_name(root_dir.name + '.tmp')
+        generate.generate(partial, notes=size, shape=shape)
+        partial.rename(root_dir)
+
+    return root_dir
+
+
+def compare(results, baseline, threshold):
+    """Return regressions of results against a baseline."""
+    regressions = []
+
+    for size, phases in results['results'].items():
+        for phase, values in phases.items():
+            base = baseline.get('results', {}).get(size, {}).get(phase)
+
+            if not base:
+                continue
+
+            for key, value in values.items():
+                if base.get(key) and value > base[key] * (1 + threshold):
+                    regressions.append(
+                        f'{size} {phase} {key}: {base[key]} -> {value} '
+                        f'(+{(value / base[key] - 1) * 100:.0f}%)')
+
+    return regressions
+
+
+def main():
+    """Run the benchmarks and write or compare JSON results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--work-dir',
+                        default=None,
+                        help='keep generated notebooks here between runs')
+    parser.add_argument('--output', default=None, help='write JSON here')
+    parser.add_argument('--compare',
+                        default=None,
+                        help='baseline JSON to check for regressions')
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.2,
+                        help='allowed slow down before flagging, eg 0.2')
+    generate.add_arguments(parser)
+    args = parser.parse_args()
+    shape = generate.get_shape(args)
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': dataclasses.asdict(shape),
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = args.work_dir or tmp
+
+        for size in args.sizes:
+            root_dir = get_notebook(work_dir, size, shape)
+            phases = bench(root_dir, args.runs)
+            results['results'][str(size)] = phases
+
+            for phase, values in phases.items():
+                print(f'{size:>7} {phase:<13} {values["time_ms"]:10.1f} ms '
+                      f'{values["peak_kib"]:10d} KiB')
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + '\n',
+                                     encoding='utf-8')
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        regressions = compare(results, baseline, args.threshold)
+
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Benchmark sphinx_notebook command start up time.
+
+Run from the repository root::
+
+    python benchmarks/bench_startup.py --runs 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+FIXTURE = Path(__file__).resolve().parent.parent / 'tests/fixtures/notebook'
+
+COMMANDS = {
+    'import': ['-c', 'import sphinx_notebook.cli'],
+    'new target': ['-m', 'sphinx_notebook.cli', 'new', 'target'],
+    'build': ['-m', 'sphinx_notebook.cli', 'build',
+              str(FIXTURE), '{tmp}/index.rst'],
+}
+
+
+def time_command(args, runs):
+    """Return wall times in milliseconds of running a python command."""
+    times = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args = [x.format(tmp=tmp) for x in args]
+
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *args],
+                           check=True,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            times.append((time.perf_counter() - start) * 1000)
+
+    return times
+
+
+def main():
+    """Print start up time of each command."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_command(['-c', 'pass'], args.runs))
+    print(f'{"python":<12} {baseline:8.1f} ms')
+
+    for name, command in COMMANDS.items():
+        times = time_command(command, args.runs)
+        median = statistics.median(times)
+        print(f'{name:<12} {median:8.1f} ms  '
+              f'(+{median - baseline:.1f} ms, min {min(times):.1f} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""Generate a synthetic notebook for benchmarks.
+
+Run from the repository root::
+
+    python benchmarks/generate.py --notes 10000 --depth 3 --fanout 8 /tmp/nb
+"""
+import argparse
+import dataclasses
+import itertools
+import random
+from pathlib import Path
+
+GROUPS = ['checklist', 'howto', 'reference', 'log', 'cheatsheet', 'diy']
+
+WORDS = ('alpha bravo charlie delta echo foxtrot golf hotel india juliet '
+         'kilo lima mike november oscar papa quebec romeo sierra tango').split()
+
+
+@dataclasses.dataclass(frozen=True)
+class Shape:
+    """Layout of a synthetic notebook.
+
+    Notes are spread evenly over the directories of a tree with the given
+    depth and fan-out. group_ratio of them get a group prefix drawn from
+    groups names, and meta_density of the directories get a _meta.yaml.
+    """
+
+    depth: int = 2
+    fanout: int = 5
+    group_ratio: float = 0.5
+    groups: int = 4
+    note_size: int = 512
+    meta_density: float = 0.2
+    seed: int = 0
+
+
+def get_dirs(depth, fanout):
+    """Return relative section directories, deepest last."""
+    dirs = []
+
+    for level in range(1, depth + 1):
+        for parts in itertools.product(range(fanout), repeat=level):
+            dirs.append(Path(*[f'section_{x}' for x in parts]))
+
+    return dirs
+
+
+def note_text(rng, target, title, size):
+    """Return the text of a note of about size bytes."""
+    lines = [f'.. _{target}:', '', '=' * len(title), title, '=' * len(title),
+             '']
+    length = sum(len(x) + 1 for x in lines)
+
+    while length < size:
+        line = ' '.join(rng.choice(WORDS) for _ in range(10)).capitalize()
+        lines.append(line + '.')
+        length += len(line) + 2
+
+    return '\n'.join(lines) + '\n'
+
+
+def meta_text(rng, groups):
+    """Return a _meta.yaml overriding header and column order."""
+    order = rng.sample(groups, len(groups))
+    columns = ', '.join(f'"{x.capitalize()}"' for x in order)
+
+    return (f'---\nheader: "{rng.choice(WORDS).capitalize()} notes"\n'
+            f'column_order: [{columns}]\n')
+
+
+def generate(root_dir, *, notes=1000, shape=Shape()):
+    """Write a synthetic notebook to root_dir and return its note count."""
+    rng = random.Random(shape.seed)
+    root_dir = Path(root_dir)
+    dirs = get_dirs(shape.depth, shape.fanout) or [Path('.')]
+    names = GROUPS[:shape.groups]
+
+    root_dir.mkdir(parents=True, exist_ok=True)
+    (root_dir / '_meta.yaml').write_text(
+        '---\ntitle: "Benchmark Notebook"\nheader: "Synthetic notes"\n')
+
+    for rel_dir in dirs:
+        (root_dir / rel_dir).mkdir(parents=True, exist_ok=True)
+
+        if rng.random() < shape.meta_density:
+            (root_dir / rel_dir / '_meta.yaml').write_text(
+                meta_text(rng, names))
+
+    for i in range(notes):
+        rel_dir = dirs[i % len(dirs)]
+        stem = f'note_{i}'
+
+        if names and rng.random() < shape.group_ratio:
+            stem = f'{rng.choice(names)}__{stem}'
+
+        target = f'n{i:09d}'
+        (root_dir / rel_dir / f'{stem}.rst').write_text(
+            note_text(rng, target, f'Note {i}', shape.note_size))
+
+    return notes
+
+
+def add_arguments(parser):
+    """Add generator options to an argument parser."""
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--group-ratio', type=float, default=0.5)
+    parser.add_argument('--groups', type=int, default=4)
+    parser.add_argument('--note-size', type=int, default=512)
+    parser.add_argument('--meta-density', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def get_shape(args):
+    """Return the notebook shape from parsed arguments."""
+    return Shape(depth=args.depth,
+                 fanout=args.fanout,
+                 group_ratio=args.group_ratio,
+                 groups=args.groups,
+                 note_size=args.note_size,
+                 meta_density=args.meta_density,
+                 seed=args.seed)
+
+
+def main():
+    """Write a synthetic notebook."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=1000)
+    add_arguments(parser)
+    parser.add_argument('dst')
+    args = parser.parse_args()
+
+    generate(args.dst, notes=args.notes, shape=get_shape(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,12 @@
 """Top-level package for Sphinx Notebook."""
 
-import re
-from dataclasses import dataclass, field
-from pathlib import Path
-
-import anytree
-
-from . import notebook
-
 __author__ = """Justin Stout"""
 __email__ = 'midwatch@jstout.us'
 __version__ = '0.10.1'
+
+
+def setup(app):
+    """Set up the Sphinx extension, see sphinx_notebook.sphinxext."""
+    from . import sphinxext  # pylint: disable=import-outside-toplevel
+
+    return {'version': __version__, **sphinxext.setup(app)}
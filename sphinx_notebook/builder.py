@@ -0,0 +1,619 @@
+"""Index outputs: whole, streamed, sharded by section or spliced."""
+import dataclasses
+import itertools
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import jinja2
+
+from . import data, util, walk
+from .cache import ScanCache
+from .notebook import (ScanError, ScanOptions, find_files, get_index_meta,
+                       get_notes, get_readers, get_sections, iter_sections,
+                       scan_files, to_tree)
+from .timings import Timings, phase
+
+# Written by the index template before each section, see find_section.
+SECTION_MARKER_RE = re.compile(r'^\.\. notebook-section: (.*?)[ \t]*$', re.M)
+
+# Shards written by the last sharded build, kept in the shard directory.
+SHARDS_FILE = '.shards.json'
+
+
+@dataclasses.dataclass(frozen=True)
+class BuildOptions:
+    """Template and layout of the index written for a notebook.
+
+    Sections down to split_depth get a shard of their own next to dst. With
+    stream, the index is rendered while the notes are read. The notes and
+    meta data each output renders are only recorded with sources.
+    """
+
+    template: jinja2.Template
+    dst: Path
+    split_depth: int = 0
+    stream: bool = False
+    sources: bool = True
+
+
+def read_shards(dst: Path) -> List[Path]:
+    """Return the shards of dst written by the last sharded build."""
+    shard_dir = dst.with_suffix('')
+
+    try:
+        with (shard_dir / SHARDS_FILE).open(encoding='utf-8') as fd_in:
+            shards = json.load(fd_in)
+
+    except (OSError, ValueError):
+        return []
+
+    if not isinstance(shards, list):
+        return []
+
+    return [shard_dir / x for x in shards]
+
+
+def get_outputs(root_dir: Path,
+                dst: Path,
+                split_depth: int = 0) -> List[str]:
+    """Return index and shard paths relative to the notebook, if inside it.
+
+    Pass the result as the walk exclude of get_notes so that generated files are not
+    read back as notes. The shard directory is only excluded with
+    split_depth; raise ValueError if it holds notes that are not shards.
+    """
+    root_dir = root_dir.resolve()
+    shard_dir = dst.with_suffix('')
+    shards = read_shards(dst)
+    outputs = []
+
+    for path in [dst, *shards, shard_dir] if split_depth else [dst, *shards]:
+        try:
+            outputs.append(path.resolve().relative_to(root_dir).as_posix())
+
+        except ValueError:
+            pass
+
+    if split_depth and shard_dir.is_dir() and root_dir in (
+            shard_dir.resolve(), *shard_dir.resolve().parents):
+        shards = set(shards)
+
+        if any(x not in shards for x in shard_dir.rglob('*.rst')):
+            raise ValueError(f'{shard_dir}: shard directory is a notebook '
+                             'section, choose another output path')
+
+    return outputs
+
+
+def _rebase(node: data.Node, depth: int) -> data.Section:
+    """Compile a section with its depth relative to a shard."""
+    section = data.Section.from_node(node)
+    return dataclasses.replace(section, depth=section.depth - depth)
+
+
+def _rel_path(node: data.Node) -> str:
+    """Return the path of a node relative to the notebook."""
+    return '/'.join(x.name for x in node.path[1:])
+
+
+def get_sources(nodes: Iterable[data.Node]) -> List[str]:
+    """Return notes and meta data files rendered for section nodes."""
+    sources = []
+
+    for node in nodes:
+        rel_path = _rel_path(node)
+        prefix = f'{rel_path}/' if rel_path else ''
+
+        if hasattr(node, 'meta_path'):
+            sources.append(f'{prefix}{walk.META_FILE}')
+
+        if node.depth:
+            sources.extend(f'{prefix}{x.name}' for x in node.notes)
+
+    return sorted(sources)
+
+
+def get_shard_root(node: data.Node, split_depth: int) -> data.Node:
+    """Return the node whose shard renders node."""
+    return node.path[min(node.depth, split_depth)]
+
+
+def get_shard_path(node: data.Node, dst: Path) -> Path:
+    """Return the output path of the shard of a node."""
+    if not node.depth:
+        return dst
+
+    parts = [x.name for x in node.path[1:]]
+    return dst.with_suffix('').joinpath(*parts[:-1], f'{parts[-1]}.rst')
+
+
+def get_shards(
+    root: data.Node,
+    index_meta: data.MetaData,
+    build: BuildOptions,
+    *,
+    only: Optional[List[data.Node]] = None
+) -> Iterator[Tuple[Path, dict, List[data.Node]]]:
+    """Yield output path, template context and tree nodes for each shard.
+
+    Sections down to split_depth get a file of their own, linked from their
+    parent with a toctree. Deeper sections are rendered inline in the shard
+    of their ancestor. Shards are written next to dst in a directory named
+    after its stem. only limits the output to the shards of those nodes.
+    """
+    dst, split_depth = build.dst, build.split_depth
+    shard_dir = dst.with_suffix('')
+    wanted = None if only is None else {id(x) for x in only}
+
+    def _toctree(node, prefix):
+        return [
+            f'{prefix}{x.name}' for x in node.children if not x.is_leaf
+        ]
+
+    if wanted is None or id(root) in wanted:
+        yield dst, {
+            'title': index_meta.title,
+            'header': index_meta.header,
+            'nodes': [],
+            'toctree': _toctree(root, f'{shard_dir.name}/')
+        }, [root]
+
+    stack = [x for x in reversed(root.children) if not x.is_leaf]
+
+    while stack:
+        node = stack.pop()
+
+        if node.depth < split_depth:
+            stack.extend(x for x in reversed(node.children) if not x.is_leaf)
+
+        if wanted is not None and id(node) not in wanted:
+            continue
+
+        # the shard title and header stand in for the section heading
+        nodes = [dataclasses.replace(_rebase(node, node.depth), header='')]
+        tree_nodes = [node]
+
+        if node.depth < split_depth:
+            toctree = _toctree(node, f'{node.name}/')
+
+        else:
+            toctree = []
+            tree_nodes.extend(x for x in node.descendants if not x.is_leaf)
+            nodes.extend(_rebase(x, node.depth) for x in tree_nodes[1:])
+
+        yield get_shard_path(node, dst), {
+            'title': node.title,
+            'header': getattr(node, 'header', ''),
+            'nodes': nodes,
+            'toctree': toctree
+        }, tree_nodes
+
+
+def _write_output(path: Path,
+                  text: str,
+                  nodes: Iterable[data.Node],
+                  outputs: Dict[Path, dict],
+                  timings: Optional[Timings] = None) -> None:
+    """Write an output if it changed and record it for the manifest."""
+    with phase(timings, 'write'), util.AtomicFile(path) as out:
+        out.write(text)
+
+    outputs[path] = {
+        'changed': out.changed,
+        'digest': out.digest,
+        'sources': get_sources(nodes)
+    }
+
+
+def write_index(root: data.Node,
+                index_meta: data.MetaData,
+                build: BuildOptions,
+                *,
+                timings: Optional[Timings] = None) -> Dict[Path, dict]:
+    """Render notebook tree into index.rst, replacing it only if changed.
+
+    Return the output record used by write_manifest.
+    """
+    nodes = [root] + [x for x in root.descendants if not x.is_leaf]
+    outputs = {}
+
+    with phase(timings, 'render'):
+        ctx = {
+            'title': index_meta.title,
+            'header': index_meta.header,
+            'nodes': get_sections(root)
+        }
+        text = build.template.render(ctx)
+
+    _write_output(build.dst, text, nodes, outputs, timings)
+
+    return outputs
+
+
+def _scan_collect(func: Callable, root_dir: Path, paths: List[Path],
+                  executor: Optional[ThreadPoolExecutor],
+                  failures: list) -> list:
+    """Apply func to each path, adding per file failures to failures."""
+    try:
+        return scan_files(func, root_dir, paths, executor)
+
+    except ScanError as scan_error:
+        failures.extend(scan_error.failures)
+        return []
+
+
+def _peek_index_meta(
+    dirs: Iterator[tuple]
+) -> Tuple[Iterator[tuple], data.MetaData]:
+    """Return the directories read and meta data of the notebook root."""
+    first = next(dirs, None)
+
+    if first is None:
+        return dirs, data.MetaData('.')
+
+    dirs = itertools.chain([first], dirs)
+
+    if first[0] == '' and first[2]:
+        return dirs, first[2][0]
+
+    return dirs, data.MetaData('.')
+
+
+def _finish_scan(options: ScanOptions, indexed: Optional[List[str]],
+                 counts: Dict[str, int]) -> None:
+    """Prune notes not scanned from the indexes and record counts."""
+    for index in options.indexes:
+        index.prune(indexed)
+
+    if options.timings:
+        for name, value in counts.items():
+            options.timings.count(name, value)
+
+
+def stream_index(root_dir: Path,
+                 build: BuildOptions,
+                 options: Optional[ScanOptions] = None,
+                 *,
+                 exclude: Iterable[str] = ()) -> Dict[Path, dict]:
+    """Scan a notebook and render its index while the notes are read.
+
+    Each section is written to dst as soon as its directory is read, so
+    memory grows with the depth of the notebook and its widest section
+    rather than its size. The output sources are only kept with sources.
+    The index is replaced only if the scan succeeds and its content
+    changed; files that fail to parse are raised together as a ScanError.
+    Return the output record used by write_manifest.
+    """
+    options = options or ScanOptions()
+    readers = get_readers(options)
+    indexed = [] if options.indexes else None
+    counts = {'files_visited': 0, 'notes': 0, 'sections': 0}
+    failures = []
+    records = []
+
+    def _dirs():
+        found = find_files(root_dir,
+                           walk.WalkOptions(exclude=exclude, files_first=True),
+                           cache=options.cache,
+                           git=options.git)
+
+        for parent, entries in itertools.groupby(found, lambda x: x[1].parent):
+            paths = {walk.NOTE: [], walk.META: []}
+
+            for kind, path in entries:
+                paths[kind].append(path)
+
+            if indexed is not None:
+                indexed.extend(x.relative_to(root_dir).as_posix()
+                               for x in paths[walk.NOTE])
+
+            counts['files_visited'] += sum(len(x) for x in paths.values())
+            notes = _scan_collect(readers[0], root_dir, paths[walk.NOTE],
+                                  options.executor, failures)
+            counts['notes'] += len(notes)
+            rel_dir = parent.relative_to(root_dir).as_posix()
+
+            yield ('' if rel_dir == '.' else rel_dir, notes,
+                   _scan_collect(readers[1], root_dir, paths[walk.META],
+                                 options.executor, failures))
+
+    def _visit(node):
+        counts['sections'] += bool(node.depth)
+
+        if build.sources:
+            records.extend(get_sources([node]))
+
+    with phase(options.timings, 'stream'), util.AtomicFile(build.dst) as out:
+        dirs, index_meta = _peek_index_meta(_dirs())
+
+        for chunk in build.template.generate({
+                'title': index_meta.title,
+                'header': index_meta.header,
+                'nodes': iter_sections(dirs, _visit)
+        }):
+            out.write(chunk)
+
+        if failures:
+            raise ScanError(failures)
+
+    _finish_scan(options, indexed, counts)
+
+    return {
+        build.dst: {
+            'changed': out.changed,
+            'digest': out.digest,
+            'sources': sorted(records)
+        }
+    }
+
+
+def render_shards(root: data.Node,
+                  index_meta: data.MetaData,
+                  build: BuildOptions,
+                  *,
+                  only: Optional[List[data.Node]] = None,
+                  timings: Optional[Timings] = None) -> Dict[Path, dict]:
+    """Render notebook tree into a root index and section shards.
+
+    Only shards whose content changed are rewritten and, unless only limits
+    the shards rendered, shards of removed sections are deleted. Shards are
+    recorded in the shard directory and only recorded ones are deleted.
+    Return the output records used by write_manifest.
+    """
+    shard_dir = build.dst.with_suffix('')
+    recorded = read_shards(build.dst)
+    outputs = {}
+
+    shards = get_shards(root, index_meta, build, only=only)
+
+    while True:
+        with phase(timings, 'render'):
+            shard = next(shards, None)
+
+            if shard is None:
+                break
+
+            path, ctx, nodes = shard
+            text = build.template.render(ctx)
+
+        _write_output(path, text, nodes, outputs, timings)
+
+    if only is None:
+        for path in recorded:
+            if path not in outputs and path.is_file():
+                path.unlink()
+
+    written = {
+        x.relative_to(shard_dir).as_posix()
+        for x in itertools.chain(outputs, [] if only is None else recorded)
+        if x != build.dst
+    }
+
+    if written or recorded:
+        util.write_if_changed(shard_dir / SHARDS_FILE,
+                              json.dumps(sorted(written), indent=2) + '\n')
+
+    return outputs
+
+
+def find_section(text: str, rel_path: str) -> Optional[Tuple[int, int]]:
+    """Return the span of a section and its subsections in rendered text.
+
+    Sections are found by the marker the index template writes first in
+    each section. Return None if the section has no marker.
+    """
+    start = None
+
+    for match in SECTION_MARKER_RE.finditer(text):
+        marked = match.group(1)
+
+        if start is None:
+            if marked == rel_path:
+                start = match.start()
+
+        elif not marked.startswith(f'{rel_path}/'):
+            return start, match.start()
+
+    return None if start is None else (start, len(text))
+
+
+def splice_section(node: data.Node,
+                   index_meta: data.MetaData,
+                   build: BuildOptions,
+                   *,
+                   timings: Optional[Timings] = None) -> Dict[Path, dict]:
+    """Render a section and its subsections into the output holding it.
+
+    Only the sections below node are rendered and they replace their old
+    text in place, found by section markers. Sections down to split_depth
+    have shards of their own, which are rendered whole. Raise ValueError if
+    the output has no marker for the section. Return the output records.
+    """
+    shard_root = get_shard_root(node, build.split_depth)
+
+    if build.split_depth and shard_root is node:
+        return render_shards(node.root,
+                             index_meta,
+                             build,
+                             only=[node] + [
+                                 x for x in node.descendants
+                                 if not x.is_leaf
+                                 and x.depth <= build.split_depth
+                             ],
+                             timings=timings)
+
+    path = get_shard_path(shard_root, build.dst)
+    rel_path = _rel_path(node)
+    nodes = [node] + [x for x in node.descendants if not x.is_leaf]
+
+    try:
+        with path.open(encoding='utf-8', newline='') as fd_in:
+            text = fd_in.read()
+
+    except FileNotFoundError:
+        text = ''
+
+    span = find_section(text, rel_path)
+
+    if span is None:
+        raise ValueError(f'{path}: no marker for section {rel_path}, '
+                         'run a full build')
+
+    with phase(timings, 'render'):
+        ctx = {
+            'title': index_meta.title,
+            'header': index_meta.header,
+            'nodes': [_rebase(x, shard_root.depth) for x in nodes]
+        }
+        rendered = build.template.render(ctx)
+        start, _ = find_section(rendered, rel_path)
+
+    outputs = {}
+    _write_output(path, text[:span[0]] + rendered[start:] + text[span[1]:],
+                  nodes, outputs, timings)
+
+    return outputs
+
+
+def get_parent_meta(root_dir: Path,
+                    subdir: str,
+                    cache: Optional[ScanCache] = None) -> List[data.MetaData]:
+    """Return meta data of the directories above subdir, root first."""
+    meta_from_yaml = cache.meta_data if cache else data.MetaData.from_yaml
+    parts = Path(subdir).parts
+    meta_data = []
+
+    for i in range(len(parts)):
+        for kind, path in walk.walk(root_dir,
+                                    subdir='/'.join(parts[:i]),
+                                    recursive=False):
+            if kind == walk.META:
+                meta_data.append(meta_from_yaml(root_dir, path))
+
+    return meta_data
+
+
+def _save_scan(options: ScanOptions,
+               echo: Callable[[str], None],
+               subdir: str = '') -> None:
+    """Save the cache and indexes updated by a scan and report on them."""
+    if options.cache:
+        options.cache.save(subdir)
+        echo(options.cache.report())
+
+    if options.targets:
+        options.targets.save()
+
+        for label, locations in options.targets.duplicates().items():
+            echo(f'duplicate target {label}: {len(locations)} notes')
+
+    if options.search:
+        options.search.save()
+
+
+def build_notebook(root_dir: Path,
+                   build: BuildOptions,
+                   options: Optional[ScanOptions] = None,
+                   *,
+                   only: Optional[str] = None,
+                   echo: Callable[[str], None] = print) -> Dict[Path, dict]:
+    """Scan a notebook and write its index, or its shards with split_depth.
+
+    With only, a section path relative to the notebook, just that subtree
+    is scanned and spliced into the existing outputs. With stream, the
+    index is rendered while the notes are read, see stream_index. The cache
+    and indexes of options are saved after the scan. Raise ScanError if
+    notes fail to parse, ValueError if the only section cannot be spliced,
+    and return the output records otherwise.
+    """
+    options = options or ScanOptions()
+
+    if build.stream:
+        if build.split_depth or only:
+            raise ValueError('streamed builds write a single index')
+
+        outputs = stream_index(root_dir,
+                               build,
+                               options,
+                               exclude=get_outputs(root_dir, build.dst))
+        _save_scan(options, echo)
+
+    else:
+        outputs = _build_tree(root_dir, build, options, only=only, echo=echo)
+
+    if options.timings:
+        options.timings.count('outputs', len(outputs))
+        options.timings.count('written', sum(1 for x in outputs.values()
+                                             if x['changed']))
+
+    return outputs
+
+
+def _build_tree(root_dir: Path, build: BuildOptions, options: ScanOptions,
+                *, only: Optional[str],
+                echo: Callable[[str], None]) -> Dict[Path, dict]:
+    """Scan a notebook into a tree and write its outputs."""
+    subdir = only or ''
+    timings = options.timings
+    notes, meta_data = get_notes(root_dir,
+                                 walk.WalkOptions(exclude=get_outputs(
+                                     root_dir, build.dst, build.split_depth)),
+                                 options=options,
+                                 subdir=subdir)
+
+    if only:
+        meta_data = get_parent_meta(root_dir, only,
+                                    options.cache) + meta_data
+
+    _save_scan(options, echo, subdir)
+
+    with phase(timings, 'tree'):
+        tree = to_tree(notes, meta_data)
+
+    index_meta = get_index_meta(meta_data)
+
+    if only:
+        node = tree.resolve(only)
+
+        if node is None or node.is_leaf or not node.depth:
+            raise ValueError(f'{only}: no notes in section')
+
+        outputs = splice_section(node, index_meta, build, timings=timings)
+
+    elif build.split_depth:
+        outputs = render_shards(tree, index_meta, build, timings=timings)
+
+    else:
+        outputs = write_index(tree, index_meta, build, timings=timings)
+
+    if timings:
+        timings.count('notes', len(notes))
+        timings.count('sections',
+                      sum(1 for x in tree.descendants if not x.is_leaf))
+
+    return outputs
+
+
+def write_manifest(path: Path, root_dir: Path,
+                   outputs: Dict[Path, dict]) -> bool:
+    """Write the notes and meta data files that produced each output.
+
+    Output paths are relative to the manifest and sources relative to the
+    notebook. The manifest is only replaced when its content changes.
+    """
+    manifest = {
+        'root': str(root_dir),
+        'outputs': {
+            Path(os.path.relpath(x, path.parent)).as_posix(): {
+                'digest': y['digest'],
+                'sources': y['sources']
+            }
+            for x, y in sorted(outputs.items())
+        }
+    }
+
+    return util.write_if_changed(path, json.dumps(manifest, indent=2) + '\n')
@@ -0,0 +1,159 @@
+"""Persistent scan cache."""
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from . import data, util
+
+CACHE_NAME = 'scan.json'
+CACHE_VERSION = 4
+
+# Files modified this close to the scan are not trusted on the next build,
+# their mtime may not change again within the file system's granularity.
+RACY_NS = 2_000_000_000
+
+
+def _digest(path: Path) -> str:
+    """Return content hash of a file."""
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+class ScanCache:  # pylint: disable=too-many-instance-attributes
+    """Cache of parsed notes and meta data keyed by file state.
+
+    Files with a content key in keys, eg their git blob hash, are keyed by
+    it instead and are not stat'ed.
+    """
+
+    def __init__(self, cache_dir, root_dir, *, checksum=False):
+        """Load the cache of root_dir from cache_dir."""
+        self.path = Path(cache_dir) / CACHE_NAME
+        self.root = str(Path(root_dir).resolve())
+        self.checksum = checksum
+        self.hits = 0
+        self.misses = 0
+        self.keys = {}
+        self._started = time.time_ns()
+        self._entries = {}
+        self._seen = {}
+        self._lock = threading.Lock()
+
+        self._load()
+
+    def _load(self):
+        try:
+            with self.path.open(encoding='utf-8') as fd_in:
+                cached = json.load(fd_in)
+
+        except (OSError, ValueError):
+            return
+
+        if not isinstance(cached, dict):
+            return
+
+        if cached.get('version') != CACHE_VERSION:
+            return
+
+        if cached.get('root') != self.root or cached.get(
+                'checksum') != self.checksum:
+            return
+
+        self._entries = cached.get('entries', {})
+
+    def _lookup(self, root_dir, path, kind, factory):
+        rel_path = path.relative_to(root_dir).as_posix()
+        key = f'{kind}:{rel_path}'
+        blob = self.keys.get(rel_path)
+
+        if blob:
+            state = {'blob': blob}
+            trusted = True
+
+        else:
+            stat = path.stat()
+            state = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+            trusted = self._started - stat.st_mtime_ns > RACY_NS
+
+            if self.checksum:
+                state['hash'] = _digest(path)
+
+        entry = self._entries.get(key)
+
+        hit = bool(entry) and entry['state'] == state
+
+        if hit:
+            value = entry['value']
+
+        else:
+            value = dataclasses.asdict(factory(root_dir, path))
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+
+            else:
+                self.misses += 1
+
+            if trusted:
+                self._seen[key] = {'state': state, 'value': value}
+
+        return value
+
+    def note(self,
+             root_dir: Path,
+             path: Path,
+             max_bytes: Optional[int] = util.TITLE_MAX_BYTES) -> data.Note:
+        """Return a note, parsing the file only if it changed."""
+        return data.Note(**self._lookup(
+            root_dir, path, 'note',
+            functools.partial(data.Note.from_path, max_bytes=max_bytes)))
+
+    def meta_data(self, root_dir: Path, path: Path) -> data.MetaData:
+        """Return meta data, parsing the file only if it changed."""
+        return data.MetaData(
+            **self._lookup(root_dir, path, 'meta', data.MetaData.from_yaml))
+
+    def report(self) -> str:
+        """Return a cache hit/miss summary."""
+        return f'scan cache: {self.hits} hits, {self.misses} misses'
+
+    def save(self, subdir: str = ''):
+        """Atomically write entries seen during this scan.
+
+        After a scan of subdir, entries outside it are kept from the last one.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        entries = self._seen
+
+        if subdir:
+            prefix = f'{subdir}/'
+            entries = {
+                **{
+                    x: y
+                    for x, y in self._entries.items()
+                    if not x.partition(':')[2].startswith(prefix)
+                },
+                **self._seen
+            }
+
+        cached = {
+            'version': CACHE_VERSION,
+            'root': self.root,
+            'checksum': self.checksum,
+            'entries': entries,
+        }
+
+        with tempfile.NamedTemporaryFile('w',
+                                         encoding='utf-8',
+                                         dir=self.path.parent,
+                                         delete=False) as fd_out:
+            json.dump(cached, fd_out)
+
+        os.replace(fd_out.name, self.path)
@@ -0,0 +1,226 @@
+"""Cross-reference checks of a notebook without a Sphinx build."""
+import functools
+import posixpath
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import jinja2
+
+from . import data, notebook, walk
+from .targets import TARGET_RE, normalize
+
+# Role text may wrap across lines but not across a blank line.
+ROLE_RE = re.compile(r':(?:std:)?(doc|ref):`((?:[^`\n]|\n(?![ \t]*\n))+)`')
+
+# A role target with an explicit title, as Sphinx splits it.
+EXPLICIT_TITLE_RE = re.compile(r'^(.+?)\s*<([^<]*?)>$', re.S)
+LABEL_RE = re.compile(TARGET_RE.pattern.replace(r'^\s*', r'^[ \t]*'),
+                      re.M)
+
+# Labels Sphinx defines without a target in the notebook.
+STD_LABELS = frozenset(['genindex', 'modindex', 'py-modindex', 'search'])
+
+# Notes scanned per task when scanning in parallel.
+CHUNK_SIZE = 256
+
+
+def _line_numbers(text: str, matches) -> Iterator[Tuple[int, re.Match]]:
+    """Yield matches in order with their line number."""
+    line, offset = 1, 0
+
+    for match in matches:
+        line += text.count('\n', offset, match.start())
+        offset = match.start()
+        yield line, match
+
+
+def scan_text(text: str) -> Tuple[list, list]:
+    """Return (label, line) of targets and (role, target, line) of references."""
+    labels = []
+    references = []
+
+    if '.. _' in text:
+        for line, match in _line_numbers(text, LABEL_RE.finditer(text)):
+            labels.append((match.group(1).strip('`'), line))
+
+    if ':doc:`' in text or ':ref:`' in text:
+        for line, match in _line_numbers(text, ROLE_RE.finditer(text)):
+            explicit = EXPLICIT_TITLE_RE.match(match.group(2))
+            target = explicit.group(2) if explicit else match.group(2)
+            target = ' '.join(target.split())
+
+            if not target.startswith('!'):
+                references.append((match.group(1), target, line))
+
+    return labels, references
+
+
+def scan_notes(root_dir: Path, paths: List[Path]) -> Tuple[list, list]:
+    """Return (note, scan) of each note and (path, error) of failures.
+
+    scan holds the targets and references of a note read in full.
+    """
+    scans = []
+    failures = []
+
+    for path in paths:
+        try:
+            with path.open(encoding='utf-8') as fd_in:
+                text = fd_in.read()
+
+            note = data.Note.from_text(root_dir, path, text)
+            scans.append((note, scan_text(text)))
+
+        except Exception as error:  # pylint: disable=broad-except
+            failures.append((path, error))
+
+    return scans, failures
+
+
+def get_docname(url: str) -> str:
+    """Return the Sphinx document name of a note url."""
+    return posixpath.normpath(url).lstrip('/')
+
+
+def resolve_doc(docname: str, target: str) -> str:
+    """Return the document a :doc: target in docname points to."""
+    if target.startswith('/'):
+        return posixpath.normpath(target).lstrip('/')
+
+    return posixpath.normpath(
+        posixpath.join(posixpath.dirname(docname), target))
+
+
+def _scan_notebook(
+    root_dir: Path, exclude: Iterable[str], jobs: int
+) -> Tuple[List[data.Note], List[data.MetaData], List[tuple]]:
+    """Return the notes and meta data of a notebook and the scan of each note.
+
+    Notes are read in chunks by a pool of jobs threads. Files that fail to
+    parse are raised together as a ScanError.
+    """
+    paths = {walk.NOTE: [], walk.META: []}
+
+    for kind, path in notebook.find_files(root_dir,
+                                          walk.WalkOptions(exclude=exclude)):
+        paths[kind].append(path)
+
+    note_paths = paths[walk.NOTE]
+    chunks = [
+        note_paths[i:i + CHUNK_SIZE]
+        for i in range(0, len(note_paths), CHUNK_SIZE)
+    ]
+
+    with notebook.thread_pool(jobs) as executor:
+        results = list((executor.map if executor else map)(
+            functools.partial(scan_notes, root_dir), chunks))
+
+    failures = [x for _, chunk in results for x in chunk]
+
+    if failures:
+        raise notebook.ScanError(failures)
+
+    _, meta_data = notebook.read_notes(root_dir, [], paths[walk.META])
+
+    return ([x for chunk, _ in results for x, _ in chunk], meta_data,
+            [x for chunk, _ in results for _, x in chunk])
+
+
+def _find_labels(sources: List[Tuple[str, str]],
+                 scans: List[tuple]) -> Dict[str, list]:
+    """Return [rel_path, line] of each target by normalized label."""
+    labels = {}
+
+    for (rel_path, _), (targets, _) in zip(sources, scans):
+        for label, line in targets:
+            labels.setdefault(normalize(label), []).append([rel_path, line])
+
+    return labels
+
+
+def _find_dangling(sources: List[Tuple[str, str]], scans: List[tuple],
+                   labels: Dict[str, list]) -> Tuple[int, List[dict]]:
+    """Return the number of references and those that resolve to nothing.
+
+    sources are (rel_path, docname) of the documents scanned.
+    """
+    docs = {x for _, x in sources}
+    dangling = []
+    count = 0
+
+    for (rel_path, docname), (_, references) in zip(sources, scans):
+        for role, target, line in references:
+            count += 1
+
+            if role == 'doc':
+                found = resolve_doc(docname, target) in docs
+
+            else:
+                label = normalize(target)
+                found = label in labels or label in STD_LABELS
+
+            if not found:
+                dangling.append({
+                    'path': rel_path,
+                    'line': line,
+                    'role': role,
+                    'target': target
+                })
+
+    return count, dangling
+
+
+def check_notebook(root_dir: Path,
+                   template: Optional[jinja2.Template] = None,
+                   *,
+                   exclude: Iterable[str] = (),
+                   jobs: int = 1) -> Dict[str, object]:
+    """Check references and targets of every note against each other.
+
+    Notes are read in chunks by a pool of jobs threads. With template, the
+    :doc: and :ref: links of the index it renders are checked too. Return
+    counts, duplicate targets and dangling references.
+    """
+    root_dir = Path(root_dir)
+    notes, meta_data, scans = _scan_notebook(root_dir, exclude, jobs)
+    sources = [(f'{x.parents.path}/{x.name}' if x.parents.path else x.name,
+                get_docname(x.url)) for x in notes]
+
+    if template:
+        index_meta = notebook.get_index_meta(meta_data)
+        text = template.render({
+            'title': index_meta.title,
+            'header': index_meta.header,
+            'nodes': notebook.get_sections(notebook.to_tree(notes, meta_data))
+        })
+        sources.append((template.name, 'index'))
+        scans.append(scan_text(text))
+
+    labels = _find_labels(sources, scans)
+    count, dangling = _find_dangling(sources, scans, labels)
+
+    return {
+        'documents': len(notes),
+        'targets': len(labels),
+        'references': count,
+        'duplicates': {x: y
+                       for x, y in sorted(labels.items()) if len(y) > 1},
+        'dangling': dangling,
+    }
+
+
+def format_report(report: Dict[str, object]) -> List[str]:
+    """Return a line per problem found by check_notebook."""
+    lines = []
+
+    for label, locations in report['duplicates'].items():
+        where = ', '.join(f'{x}:{y}' for x, y in locations)
+        lines.append(f'duplicate target {label}: {where}')
+
+    for ref in report['dangling']:
+        kind = 'document' if ref['role'] == 'doc' else 'target'
+        lines.append(
+            f'{ref["path"]}:{ref["line"]}: unknown {kind} {ref["target"]}')
+
+    return lines
@@ -1,19 +1,24 @@
-"""Console script for Sphinx Notebook."""
+"""Console script for Sphinx Notebook.
+
+Commands import the modules they need when they run, so that light commands
+such as ``new target`` do not pay for loading jinja2, anytree and yaml.
+"""
+# pylint: disable=import-outside-toplevel
+import functools
 import sys
 from pathlib import Path
 
 import click
-from jinja2 import (Environment, FileSystemLoader, PackageLoader,
-                    select_autoescape)
 
-from sphinx_notebook import filters, notebook
 
-ENV = Environment(loader=PackageLoader("sphinx_notebook"),
-                  autoescape=select_autoescape(),
-                  trim_blocks=True)
-ENV.filters["format_rst"] = filters.format_rst
-ENV.filters["table_header"] = filters.table_header
-ENV.filters["table_body"] = filters.table_body
+@functools.lru_cache(maxsize=None)
+def get_env(template_dir=None):
+    """Return a template environment with a persistent bytecode cache."""
+    from sphinx_notebook import notebook, util
+
+    return notebook.get_environment(template_dir,
+                                    cache_dir=util.get_cache_dir() /
+                                    'templates')
 
 
 @click.group()
@@ -27,31 +32,441 @@ def new():
     """Empty click anchor function."""
 
 
+@click.group()
+def targets():
+    """Query the notebook target index."""
+
+
+def get_targets(src, refresh=False):
+    """Return the target index of a notebook, building it if missing."""
+    from sphinx_notebook import targets as targets_
+
+    root_dir = Path(src)
+    index = targets_.TargetIndex.load(targets_.get_index_path(root_dir),
+                                      root_dir)
+
+    if refresh or not index.exists:
+        index.refresh(root_dir)
+        index.save()
+
+    return index
+
+
+# build options a notebooks file may set per notebook, with path values
+BUILD_OPTIONS = {
+    'src': True,
+    'dst': True,
+    'template_dir': True,
+    'template_name': False,
+    'cache_dir': True,
+    'cache_checksum': False,
+    'git': False,
+    'stream': False,
+    'split_depth': False,
+    'title_max_bytes': False,
+    'manifest': True,
+    'index_targets': False,
+    'index_search': False,
+    'search_body': False,
+    'timings': False,
+    'timings_json': True,
+    'slowest': False,
+    'profile_render': True,
+}
+
+
+def read_config(path):
+    """Return build options of each notebook in a notebooks file.
+
+    The file holds a list of notebooks, or a mapping with a notebooks list
+    and defaults applied to each of them. Relative paths are relative to
+    the file.
+    """
+    import yaml
+
+    with Path(path).open(encoding='utf-8') as fd_in:
+        config = yaml.safe_load(fd_in) or {}
+
+    if isinstance(config, list):
+        config = {'notebooks': config}
+
+    if not isinstance(config, dict) or not isinstance(
+            config.get('notebooks'), list):
+        raise click.ClickException(f'{path}: expected a list of notebooks')
+
+    unknown = set(config) - {'defaults', 'notebooks'}
+
+    if unknown:
+        raise click.ClickException(f'{path}: unknown keys {sorted(unknown)}')
+
+    entries = []
+
+    for number, notebook in enumerate(config['notebooks'], start=1):
+        entry = {**(config.get('defaults') or {}), **notebook}
+        unknown = set(entry) - set(BUILD_OPTIONS)
+
+        if unknown or 'src' not in entry or 'dst' not in entry:
+            raise click.ClickException(
+                f'{path}: notebook {number} needs src and dst and may only '
+                f'set {", ".join(BUILD_OPTIONS)}')
+
+        for key, value in entry.items():
+            if BUILD_OPTIONS[key] and value is not None:
+                entry[key] = str(Path(path).parent / value)
+
+        entries.append(entry)
+
+    return entries
+
+
+def scan_failed(scan_error, echo=None):
+    """Report each file a scan failed to read and return a click error."""
+    echo = echo or (lambda x: click.echo(x, err=True))
+
+    for path, error in scan_error.failures:
+        echo(f'{path}: {error}')
+
+    return click.ClickException(str(scan_error))
+
+
+def get_scan_options(options, executor=None):
+    """Return the caches, indexes and timings a build of one notebook uses."""
+    from sphinx_notebook import notebook, util
+    from sphinx_notebook.cache import ScanCache
+    from sphinx_notebook.timings import Timings
+
+    dir_src = Path(options['src'])
+    scan = notebook.ScanOptions(executor=executor,
+                                git=options['git'],
+                                title_max_bytes=options['title_max_bytes']
+                                or None)
+
+    if (options['timings'] or options['timings_json']
+            or options['profile_render']):
+        scan.timings = Timings(slowest=options['slowest'],
+                               profile='render'
+                               if options['profile_render'] else None)
+
+    cache_dir = options['cache_dir']
+
+    if options['git'] and not cache_dir:
+        cache_dir = util.get_notebook_cache('scan', dir_src).with_suffix('')
+
+    if cache_dir:
+        scan.cache = ScanCache(cache_dir,
+                               dir_src,
+                               checksum=options['cache_checksum'])
+
+    if options['index_targets']:
+        from sphinx_notebook.targets import TargetIndex, get_index_path
+
+        scan.targets = TargetIndex.load(get_index_path(dir_src), dir_src)
+
+    if options['index_search'] or options['search_body']:
+        from sphinx_notebook import search
+
+        scan.search = search.SearchIndex.load(search.get_index_path(dir_src),
+                                              dir_src,
+                                              body=options['search_body'])
+
+    return scan
+
+
+def build_notebook(options, *, executor=None, echo=None):
+    """Build the index of one notebook from build options.
+
+    Notes are read by executor when given. Messages are passed to echo.
+    Return the output records.
+    """
+    from sphinx_notebook import builder, notebook
+    from sphinx_notebook.timings import phase
+
+    echo = echo or (lambda x: click.echo(x, err=True))
+    scan = get_scan_options(options, executor)
+    timings = scan.timings
+
+    with phase(timings, 'template'):
+        template = get_env(options['template_dir']).get_template(
+            options['template_name'])
+
+    try:
+        outputs = builder.build_notebook(
+            Path(options['src']),
+            builder.BuildOptions(template,
+                                 Path(options['dst']),
+                                 split_depth=options['split_depth'],
+                                 stream=options['stream'],
+                                 sources=bool(options['manifest'])),
+            scan,
+            only=options['only'],
+            echo=echo)
+
+    except notebook.ScanError as scan_error:
+        raise scan_failed(scan_error, echo) from scan_error
+
+    except ValueError as error:
+        raise click.ClickException(str(error)) from error
+
+    written = [x for x, y in outputs.items() if y['changed']]
+    echo(f'{len(written)} of {len(outputs)} index file(s) written')
+
+    if timings:
+        if options['timings']:
+            echo(timings.report())
+
+        if options['timings_json']:
+            timings.write_json(Path(options['timings_json']))
+
+        if options['profile_render']:
+            timings.dump_profile(Path(options['profile_render']))
+
+    if options['manifest']:
+        builder.write_manifest(Path(options['manifest']),
+                               Path(options['src']), outputs)
+
+    return outputs
+
+
+def build_notebooks(entries, *, jobs=1, parallel=1):
+    """Build many notebooks sharing one read pool and print their status.
+
+    Return the highest exit code.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from sphinx_notebook import notebook
+
+    def _build(entry):
+        messages = []
+
+        try:
+            build_notebook(entry,
+                           executor=executor,
+                           echo=messages.append)
+            code = 0
+
+        except click.ClickException as error:
+            messages.append(f'Error: {error.format_message()}')
+            code = error.exit_code
+
+        except Exception as error:  # pylint: disable=broad-except
+            messages.append(f'Error: {error}')
+            code = 1
+
+        return code, messages
+
+    for entry in entries:
+        # compile templates once before threads share the environment
+        get_env(entry['template_dir']).get_template(entry['template_name'])
+
+    with notebook.thread_pool(jobs) as executor, ThreadPoolExecutor(
+            parallel) as notebooks:
+        results = list(notebooks.map(_build, entries))
+
+    for entry, (code, messages) in zip(entries, results):
+        status = 'ok' if code == 0 else 'failed'
+        click.echo(f'{entry["src"]} -> {entry["dst"]}: {status} ({code})',
+                   err=True)
+
+        for message in messages:
+            click.echo(f'  {message}', err=True)
+
+    return max((code for code, _ in results), default=0)
+
+
 @click.command()
+@click.option('--template-dir', default=None, help="path to custom templates")
 @click.option('--template-name',
               default='index.rst.jinja',
               help="Use alt index template")
+@click.option('--cache-dir',
+              default=None,
+              help="path to persistent scan cache")
+@click.option('--cache-checksum',
+              is_flag=True,
+              help="validate cached entries by content hash")
+@click.option('--git',
+              is_flag=True,
+              help="list files from the git index and only re-read notes "
+              "whose blob changed, implies a scan cache")
+@click.option('--jobs',
+              '-j',
+              default=1,
+              type=click.IntRange(min=1),
+              help="number of threads used to read notes")
+@click.option('--split-depth',
+              default=0,
+              type=click.IntRange(min=0),
+              help="write sections down to this depth to their own files")
+@click.option('--stream',
+              is_flag=True,
+              help="write sections while notes are read to keep memory low")
+@click.option('--title-max-bytes',
+              default=16 * 1024,
+              type=click.IntRange(min=0),
+              help="bytes of each note searched for its title before the "
+              "rest of it, 0 reads whole notes")
+@click.option('--manifest',
+              default=None,
+              help="path to write the sources of each output as JSON")
+@click.option('--index-targets',
+              is_flag=True,
+              help="update the notebook target index while scanning")
+@click.option('--index-search',
+              is_flag=True,
+              help="update the notebook search index while scanning")
+@click.option('--search-body',
+              is_flag=True,
+              help="also index note bodies, implies --index-search")
+@click.option('--timings',
+              is_flag=True,
+              help="report time, bytes read and counts per build phase")
+@click.option('--timings-json',
+              default=None,
+              help="path to write the phase timings as JSON")
+@click.option('--slowest',
+              default=10,
+              type=click.IntRange(min=0),
+              help="number of slowest files to report with --timings")
+@click.option('--profile-render',
+              default=None,
+              help="path to write cProfile stats of the render phase")
+@click.option('--only',
+              default=None,
+              help="rebuild one section, eg section_2/fiction, into the "
+              "existing index")
+@click.option('--config',
+              default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help="YAML file of notebooks to build in one run")
+@click.option('--parallel',
+              default=4,
+              type=click.IntRange(min=1),
+              help="number of notebooks built at once with --config")
+@click.argument('src', required=False)
+@click.argument('dst', required=False)
+def build(config, parallel, jobs, **options):
+    """Render an index.rst file for a sphinx based notebook.
+
+    SRC: path to source directory (eg notebook/)
+
+    DST: path to index.rst (eg build/src/index.rst)
+
+    With --config, SRC and DST are read for each notebook from a YAML file
+    that may also set other options; options given here are defaults.
+
+    With --only, just the notes below a section of SRC are scanned and
+    their sections replace the old ones in the index written last time.
+    """
+    if options['only']:
+        if config or options['manifest']:
+            raise click.UsageError(
+                '--only cannot be used with --config or --manifest')
+
+        options['only'] = Path(options['only']).as_posix().strip('/')
+
+        if options['only'] in ('', '.'):
+            options['only'] = None
+
+    if options['stream'] and (options['split_depth'] or options['only']):
+        raise click.UsageError(
+            '--stream cannot be used with --split-depth or --only')
+
+    if not config:
+        if not options['src'] or not options['dst']:
+            raise click.UsageError('SRC and DST are required without --config')
+
+        from sphinx_notebook import notebook
+
+        with notebook.thread_pool(jobs) as executor:
+            build_notebook(options, executor=executor)
+
+        return 0
+
+    if options['src'] or options['dst']:
+        raise click.UsageError('SRC and DST cannot be used with --config')
+
+    entries = [{**options, **x} for x in read_config(config)]
+    code = build_notebooks(entries, jobs=jobs, parallel=parallel)
+
+    if code:
+        sys.exit(code)
+
+    return 0
+
+
+@click.command(name='watch')
+@click.option('--template-dir', default=None, help="path to custom templates")
+@click.option('--template-name',
+              default='index.rst.jinja',
+              help="Use alt index template")
+@click.option('--split-depth',
+              default=0,
+              type=click.IntRange(min=0),
+              help="write sections down to this depth to their own files")
+@click.option('--jobs',
+              '-j',
+              default=1,
+              type=click.IntRange(min=1),
+              help="number of threads used for the initial scan")
+@click.option('--poll',
+              is_flag=True,
+              help="poll for changes instead of using inotify")
+@click.option('--interval',
+              default=1.0,
+              type=click.FloatRange(min=0.01),
+              help="seconds between polls")
+@click.option('--debounce',
+              default=0.1,
+              type=click.FloatRange(min=0),
+              help="seconds to wait for a burst of changes to settle")
 @click.argument('src')
 @click.argument('dst')
-def build(template_name, src, dst):  # pylint: disable=too-many-arguments
-    """Render an index.rst file for a sphinx based notebook.
+def watch_(*, template_dir, template_name, split_depth,  # pylint: disable=too-many-arguments
+           jobs, poll, interval, debounce, src, dst):
+    """Rebuild an index.rst file whenever the notebook changes.
 
     SRC: path to source directory (eg notebook/)
 
     DST: path to index.rst (eg build/src/index.rst)
     """
-    dir_src = Path(src)
-    index_out = Path(dst)
+    from sphinx_notebook import notebook, watch
 
-    notes, meta_data = notebook.get_notes(dir_src)
+    try:
+        book = watch.Notebook(
+            Path(src),
+            Path(dst),
+            get_env(template_dir).get_template(template_name),
+            split_depth=split_depth)
+
+    except ValueError as error:
+        raise click.ClickException(str(error)) from error
+
+    try:
+        book.load(jobs)
 
-    tree = notebook.to_tree(notes, meta_data)
+    except notebook.ScanError as scan_error:
+        raise scan_failed(scan_error) from scan_error
 
-    index_meta = meta_data[0]
+    book.render()
+
+    source = watch.get_source(Path(src),
+                              poll=poll,
+                              interval=interval,
+                              exclude=book.walk_options.exclude)
+    click.echo(f'watching {src} ({type(source).__name__})', err=True)
+
+    try:
+        watch.run(book,
+                  source,
+                  debounce=debounce,
+                  echo=lambda x: click.echo(x, err=True))
 
-    with index_out.open(encoding='utf-8', mode='w') as fd_out:
-        notebook.render_index(tree, index_meta.title, index_meta.header,
-                              ENV.get_template(template_name), fd_out)
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        source.close()
 
     return 0
 
@@ -61,42 +476,317 @@ def build(template_name, src, dst):  # pylint: disable=too-many-arguments
 @click.option('--template-name',
               default='note.rst.jinja',
               help="Use alt note template")
+@click.option('--notebook',
+              'src',
+              default=None,
+              help="notebook the note ID must be unique in")
 @click.argument('dst')
-def new_note(template_dir, template_name, dst):
+def new_note(template_dir, template_name, src, dst):
     """Add a new note from a template.
 
     DST: path to note.rst (eg notebook/section_1/sub_section_1/topic_1.rst)
     """
-    if template_dir:
-        ENV.loader = FileSystemLoader(template_dir)
+    from sphinx_notebook import notebook
 
     output = Path(dst)
+    ctx = {}
+    index = None
+
+    if src:
+        index = get_targets(src)
+        ctx['note_id'] = index.new_target()
 
     output.parent.mkdir(parents=True, exist_ok=True)
 
     try:
         with output.open(encoding='utf-8', mode='x') as out:
-            notebook.render_note(ENV.get_template(template_name), out)
+            notebook.render_note(
+                get_env(template_dir).get_template(template_name), out,
+                **ctx)
 
     except FileExistsError as file_exists:
         raise click.FileError(output, 'file exists') from file_exists
 
+    if index:
+        try:
+            index.update_file(Path(src).resolve(), output.resolve())
+            index.save()
+
+        except ValueError:
+            pass  # the note is outside the notebook
+
+    return 0
+
+
+@click.command()
+@click.option('--from',
+              'manifest',
+              required=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help="YAML or CSV list of notes (path, title, template)")
+@click.option('--template-dir', default=None, help="path to custom templates")
+@click.option('--template-name',
+              default='note.rst.jinja',
+              help="default note template")
+@click.option('--root',
+              default='.',
+              help="directory note paths are relative to")
+@click.option('--skip-existing',
+              is_flag=True,
+              help="skip existing notes instead of failing the batch")
+@click.option('--notebook',
+              'src',
+              default=None,
+              help="notebook the note IDs must be unique in")
+def new_notes(*, manifest, template_dir, template_name, root,  # pylint: disable=too-many-arguments
+              skip_existing, src):
+    """Add many notes from a manifest in one run.
+
+    Unless --skip-existing is given, no note is written if any of them
+    already exists.
+    """
+    from sphinx_notebook import notebook
+
+    index = get_targets(src) if src else None
+
+    try:
+        entries = notebook.read_note_manifest(Path(manifest))
+        created, skipped = notebook.create_notes(
+            entries,
+            get_env(template_dir).get_template,
+            root_dir=Path(root),
+            template_name=template_name,
+            skip_existing=skip_existing,
+            targets=index)
+
+    except (ValueError, FileExistsError) as error:
+        raise click.ClickException(str(error)) from error
+
+    if index and created:
+        index.refresh(Path(src))
+        index.save()
+
+    for path in skipped:
+        click.echo(f'{path}: file exists, skipped', err=True)
+
+    click.echo(f'{len(created)} note(s) created, {len(skipped)} skipped',
+               err=True)
+
     return 0
 
 
 @click.command()
 @click.option('--count', default=1, help='number of targets to generate')
-def new_target(count):
+@click.option('--notebook',
+              'src',
+              default=None,
+              help="notebook the targets must be unique in")
+def new_target(count, src):
     """Generate a new target using NanoID."""
+    from sphinx_notebook import util
+
+    new_target_ = get_targets(src).new_target if src else util.get_target
+
     for _ in range(count):
-        click.echo(notebook.get_target())
+        click.echo(new_target_())
+
+
+@click.command(name='search')
+@click.option('--limit', default=20, type=click.IntRange(min=1))
+@click.option('--refresh',
+              is_flag=True,
+              help="re-index changed notes before searching")
+@click.option('--body',
+              is_flag=True,
+              default=None,
+              help="index note bodies when the index is (re)built")
+@click.option('--json', 'as_json', is_flag=True, help="print JSON")
+@click.argument('src')
+@click.argument('query', nargs=-1, required=True)
+def search_(*, limit, refresh, body, as_json, src, query):  # pylint: disable=too-many-arguments
+    """Find notes by title, group, section or body words.
+
+    Words match the start of indexed terms and every word must match.
+
+    SRC: path to source directory (eg notebook/)
+    """
+    from sphinx_notebook import search
+
+    root_dir = Path(src)
+    index = search.SearchIndex.load(search.get_index_path(root_dir),
+                                    root_dir,
+                                    body=body)
+
+    if refresh or not index.exists or body is not None:
+        index.refresh(root_dir)
+        index.save()
+
+    results = [{
+        'score': score,
+        'path': rel_path,
+        'title': index.docs[rel_path]['title']
+    } for score, rel_path in index.search(' '.join(query), limit)]
+
+    if as_json:
+        import json
+
+        click.echo(json.dumps(results, indent=2))
+
+    else:
+        for result in results:
+            click.echo(f'{result["title"]}\t{result["path"]}')
+
+    return 0
+
+
+@click.command()
+@click.option('--template-dir', default=None, help="path to custom templates")
+@click.option('--template-name',
+              default='index.rst.jinja',
+              help="Use alt index template")
+@click.option('--no-index',
+              is_flag=True,
+              help="do not check the links of the rendered index")
+@click.option('--jobs',
+              '-j',
+              default=1,
+              type=click.IntRange(min=1),
+              help="number of threads used to read notes")
+@click.option('--json', 'as_json', is_flag=True, help="print JSON")
+@click.argument('src')
+def check(*, template_dir, template_name, no_index,  # pylint: disable=too-many-arguments
+          jobs, as_json, src):
+    """Check :doc: and :ref: links and duplicate targets in a notebook.
+
+    Exits with 1 when a problem is found.
+
+    SRC: path to source directory (eg notebook/)
+    """
+    from sphinx_notebook import check as check_
+    from sphinx_notebook import notebook
+
+    template = None
+
+    if not no_index:
+        template = get_env(template_dir).get_template(template_name)
+
+    try:
+        report = check_.check_notebook(Path(src), template, jobs=jobs)
+
+    except notebook.ScanError as scan_error:
+        raise scan_failed(scan_error) from scan_error
+
+    problems = check_.format_report(report)
+
+    if as_json:
+        import json
+
+        click.echo(json.dumps(report, indent=2))
+
+    else:
+        for line in problems:
+            click.echo(line)
+
+        click.echo(
+            f'{report["references"]} reference(s) to {report["documents"]} '
+            f'note(s) and {report["targets"]} target(s), '
+            f'{len(problems)} problem(s)',
+            err=True)
+
+    if problems:
+        sys.exit(1)
+
+    return 0
+
+
+@click.command(name='list')
+@click.option('--duplicates',
+              is_flag=True,
+              help="only list targets defined more than once")
+@click.option('--json', 'as_json', is_flag=True, help="print JSON")
+@click.option('--refresh',
+              is_flag=True,
+              help="rescan changed notes before answering")
+@click.argument('src')
+def targets_list(duplicates, as_json, refresh, src):
+    """List the targets defined in a notebook.
+
+    SRC: path to source directory (eg notebook/)
+    """
+    import json
+
+    index = get_targets(src, refresh)
+    labels = index.duplicates() if duplicates else index.labels
+    labels = dict(sorted(labels.items()))
+
+    if as_json:
+        click.echo(json.dumps(labels, indent=2))
+        return 0
+
+    for label, locations in labels.items():
+        for rel_path, line in locations:
+            click.echo(f'{label}\t{rel_path}:{line}')
+
+    return 0
+
+
+@click.command(name='lookup')
+@click.option('--refresh',
+              is_flag=True,
+              help="rescan changed notes before answering")
+@click.argument('src')
+@click.argument('labels', nargs=-1, required=True)
+def targets_lookup(refresh, src, labels):
+    """Print where targets are defined.
+
+    SRC: path to source directory (eg notebook/)
+    """
+    index = get_targets(src, refresh)
+    missing = []
+
+    for label in labels:
+        locations = index.lookup(label)
+
+        if not locations:
+            missing.append(label)
+
+        for rel_path, line in locations:
+            click.echo(f'{label}\t{rel_path}:{line}')
+
+    if missing:
+        raise click.ClickException(f'target(s) not found: {", ".join(missing)}')
+
+    return 0
+
+
+@click.command(name='update')
+@click.argument('src')
+def targets_update(src):
+    """Rescan changed notes into the target index.
+
+    SRC: path to source directory (eg notebook/)
+    """
+    index = get_targets(src, refresh=True)
+    click.echo(f'{len(index.labels)} target(s) in {len(index.files)} note(s)',
+               err=True)
+
+    return 0
 
 
 new.add_command(new_note, name='note')
+new.add_command(new_notes, name='notes')
 new.add_command(new_target, name='target')
 
+targets.add_command(targets_list)
+targets.add_command(targets_lookup)
+targets.add_command(targets_update)
+
 main.add_command(build)
+main.add_command(check)
 main.add_command(new)
+main.add_command(targets)
+main.add_command(watch_)
+main.add_command(search_)
 
 if __name__ == "__main__":
     sys.exit(main())  # pylint: disable=no-value-for-parameter
@@ -1,32 +1,132 @@
 """Data classes."""
 import dataclasses
+import functools
+import os
+import sys
+from itertools import zip_longest
 from string import capwords
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import anytree
 import yaml
 
 from . import util
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+
+except ImportError:
+    from yaml import SafeLoader
+
+TABLE_COLUMNS = 4
+
+# Column heading of ungrouped notes in a grouped section.
+UNGROUPED_NAME = 'Other'
+
+# Settings a meta data file may pass on to the sections below it.
+CASCADE_KEYS = ('header', 'column_order', 'column_names', 'table_columns',
+                'group_by', 'sort_by')
+
+_META_CACHE: Dict[Tuple[str, str], tuple] = {}
+
+# Directories whose parents tuple is kept for the notes read next.
+PARENTS_CACHE_SIZE = 4096
+
+# Shared by notes without fields, never modified.
+_NO_FIELDS: Dict[str, str] = {}
+
+
+class MetaDataError(ValueError):
+    """Raised when a meta data file does not match the schema."""
+
+
+def _is_strings(value):
+    return isinstance(value, list) and all(isinstance(x, str) for x in value)
+
+
+def _is_pairs(value):
+    return isinstance(value, list) and all(
+        _is_strings(x) and len(x) == 2 for x in value)
+
+
+META_SCHEMA = {
+    'header': lambda x: isinstance(x, str),
+    'title': lambda x: x is None or isinstance(x, str),
+    'column_order': _is_strings,
+    'column_names': _is_pairs,
+    'table_columns': lambda x: isinstance(x, int) and x > 0,
+    'group_by': lambda x: isinstance(x, str),
+    'sort_by': lambda x: isinstance(x, str),
+    'cascade': lambda x: _is_strings(x) and set(x) <= set(CASCADE_KEYS),
+}
+
 
 @dataclasses.dataclass
-class MetaData:
-    """Meta data overrides for sections."""
+class MetaData:  # pylint: disable=too-many-instance-attributes
+    """Meta data overrides for sections.
+
+    group_by names a note field to group notes by instead of their file
+    name, sort_by a field to order them by, '-field' for descending. Keys
+    named in cascade also apply to sections below this one that do not set
+    them.
+    """
 
     path: str
     header: str = dataclasses.field(default='')
     title: str = dataclasses.field(default=None)
     column_order: List[str] = dataclasses.field(default_factory=list)
     column_names: List[List[str]] = dataclasses.field(default_factory=list)
+    table_columns: int = dataclasses.field(default=None)
+    group_by: str = dataclasses.field(default=None)
+    sort_by: str = dataclasses.field(default=None)
+    cascade: List[str] = dataclasses.field(default_factory=list)
+
+    @staticmethod
+    def validate(meta_data, path):
+        """Return meta data read from path or raise MetaDataError."""
+        if meta_data is None:
+            return {}
+
+        if not isinstance(meta_data, dict):
+            raise MetaDataError(f'{path}: expected a mapping')
+
+        for key, value in meta_data.items():
+            if key not in META_SCHEMA:
+                raise MetaDataError(f'{path}: unknown key {key!r}')
+
+            if not META_SCHEMA[key](value):
+                raise MetaDataError(f'{path}: invalid value for {key!r}')
+
+        return meta_data
 
     @classmethod
     def from_yaml(cls, root_dir, path):
-        """Create a MetaData class from a meta data file."""
-        meta_data = {'path': str(path.relative_to(root_dir).parent)}
-        with path.open() as fd_in:
-            meta_data.update(yaml.safe_load(fd_in))
+        """Create a MetaData class from a meta data file.
+
+        Parsed files are kept in memory until their mtime or size changes.
+        """
+        key = (os.fspath(root_dir), os.fspath(path))
+        stat = os.stat(path)
+        state = (stat.st_mtime_ns, stat.st_size)
+        cached = _META_CACHE.get(key)
+
+        if cached and cached[0] == state:
+            return dataclasses.replace(cached[1])
+
+        with path.open(encoding='utf-8') as fd_in:
+            meta_data = cls.validate(yaml.load(fd_in, Loader=SafeLoader),
+                                     path)
 
-        return cls(**meta_data)
+        meta_data = cls(path=str(path.relative_to(root_dir).parent),
+                        **meta_data)
+        _META_CACHE[key] = (state, meta_data)
+
+        return dataclasses.replace(meta_data)
+
+    @staticmethod
+    def forget(root_dir, path):
+        """Drop a removed meta data file from the memory of from_yaml."""
+        _META_CACHE.pop((os.fspath(root_dir), os.fspath(path)), None)
 
     def to_dict(self):
         """Return meta data as dict."""
@@ -39,66 +139,168 @@ class MetaData:
         if self.title:
             data['title'] = self.title
 
+        if self.table_columns:
+            data['table_columns'] = self.table_columns
+
+        if self.group_by:
+            data['group_by'] = self.group_by
+
+        if self.sort_by:
+            data['sort_by'] = self.sort_by
+
         return data
 
 
+def get_group(note, group_by=None):
+    """Return the group of a note, or the value of its group_by field."""
+    if group_by:
+        return note.fields.get(group_by, '')
+
+    return note.group
+
+
+def sort_notes(notes, sort_by=None):
+    """Return notes ordered by the value of a field.
+
+    A leading '-' sorts in descending order. Notes without the field
+    follow in their original order.
+    """
+    if not sort_by:
+        return notes
+
+    name = sort_by.lstrip('-')
+    found = [x for x in notes if name in x.fields]
+    found.sort(key=lambda x: x.fields[name], reverse=sort_by.startswith('-'))
+
+    return found + [x for x in notes if name not in x.fields]
+
+
+def get_group_order(node, groups):
+    """Return the groups of a section in column order.
+
+    Groups missing from column_order follow it in sorted order and
+    ungrouped notes of a grouped section get the last column.
+    """
+    order = list(getattr(node, 'column_order', None) or ())
+
+    if not order and not any(groups):
+        return []
+
+    order.extend(sorted(x for x in groups if x and x not in order))
+
+    if '' in groups and '' not in order:
+        order.append('')
+
+    return order
+
+
+def get_column_names(node, group_order):
+    """Return column headings of groups, applying column_names."""
+    names = dict(getattr(node, 'column_names', ()))
+
+    return [names.get(x, x or UNGROUPED_NAME) for x in group_order]
+
+
+class Parents(tuple):
+    """Parent names of the notes in a directory, with their joined path."""
+
+    path = ''
+
+
+@functools.lru_cache(maxsize=PARENTS_CACHE_SIZE)
+def _share_parents(parents: Tuple[str, ...]) -> Parents:
+    shared = Parents(sys.intern(x) for x in parents)
+    shared.path = '/'.join(shared)
+
+    return shared
+
+
+def intern_parents(parents):
+    """Return the shared Parents of interned names for a directory.
+
+    Notes in a directory share one tuple. Only the directories used last
+    are kept, so long running processes forget removed ones.
+    """
+    return _share_parents(tuple(parents))
+
+
 class Node(anytree.Node):
-    """Class representing a note."""
+    """Class representing a note.
+
+    Each section indexes its children by name so that sections are found in
+    O(depth) rather than by scanning siblings. The index is created with
+    the first child, so note leaves do not carry one.
+    """
 
     def __eq__(self, other):
         """Compare Nodes on name attribute."""
         return self.name == other.name
 
-    def _recursive_parents(self, parents):
-        if parents:
-            yield parents[0]
-            yield from self._recursive_parents(parents[1:])
+    def _post_attach(self, parent):
+        parent.__dict__.setdefault('_by_name', {})[self.name] = self
+
+    def _post_detach(self, parent):
+        parent.__dict__.get('_by_name', {}).pop(self.name, None)
 
     @property
     def notes(self):
         """Return note nodes."""
         return [x for x in self.children if x.is_leaf]
 
+    def get_child(self, name):
+        """Return child node by name or None."""
+        by_name = self.__dict__.get('_by_name')
+
+        return by_name.get(name) if by_name else None
+
+    def resolve(self, path):
+        """Return descendant node from a relative path or None."""
+        node = self
+
+        for part in path.split('/'):
+            if part in ('', '.'):
+                continue
+
+            node = node.get_child(part)
+
+            if node is None:
+                return None
+
+        return node
+
     def add_parents(self, parents):
-        """Add parent nodes."""
+        """Add parent nodes and return the deepest one."""
+        node = self
+
         for parent in parents:
-            try:
-                child = self.children[self.children.index(Node(parent))]
+            child = node.get_child(parent)
+
+            if child is None:
+                child = Node(parent, node, title=util.to_title_case(parent))
 
-            except ValueError:
-                child = Node(parent, self, title=util.to_title_case(parent))
+            node = child
 
-            child.add_parents(parents)
+        return node
 
     def add_note(self, note):
         """Add a note to notebook tree."""
-        resolver = anytree.resolver.Resolver()
+        return self.add_parents(note.parents).append_note(note)
 
-        self.add_parents(self._recursive_parents(note.parents))
-
-        Node(note.name,
-             group=note.group,
-             parent=resolver.get(self, note.parent_path),
-             title=note.title,
-             url=note.url)
+    def append_note(self, note):
+        """Add a note as a child of this node."""
+        return NoteNode(note, self)
 
     def groups(self, *, overide_names=True):
         """Return groups names."""
-        try:
-            column_order = self.column_order[:]
-
-        except AttributeError:
-            column_order = sorted({x.group for x in self.notes if x.group})
+        group_by = getattr(self, 'group_by', None)
+        group_order = get_group_order(
+            self, {get_group(x, group_by)
+                   for x in self.notes})
 
         if overide_names:
-            try:
-                for old, new in self.column_names:
-                    column_order[column_order.index(old)] = new
-
-            except AttributeError:
-                pass
+            return get_column_names(self, group_order)
 
-        return column_order
+        return group_order
 
     def update(self, meta_data):
         """Update members using meta data overrides."""
@@ -106,30 +308,145 @@ class Node(anytree.Node):
             setattr(self, key, value)
 
 
-@dataclasses.dataclass
+class NoteNode(Node):
+    """Leaf node of a note, reading its values from the note."""
+
+    def __init__(self, note, parent=None):
+        """Create the leaf of a note below parent."""
+        self.note = note
+        super().__init__(note.name, parent)
+
+    @property
+    def is_leaf(self):
+        """Notes never have children."""
+        return True
+
+    @property
+    def group(self):
+        """Return the note group."""
+        return self.note.group
+
+    @property
+    def title(self):
+        """Return the note title."""
+        return self.note.title
+
+    @property
+    def url(self):
+        """Return the note document path."""
+        return self.note.url
+
+    @property
+    def fields(self):
+        """Return the note fields."""
+        return self.note.fields
+
+
+@dataclasses.dataclass(init=False)
 class Note:
-    """A note from the notebook tree."""
+    """A note from the notebook tree.
+
+    Notes in the same directory share their parents tuple and the url is
+    derived when it is used. fields holds the field list or docinfo at the
+    top of the note.
+    """
+
+    __slots__ = ('group', 'name', 'parents', 'title', 'fields')
 
     group: str
     name: str
-    parents: List[str]
+    parents: Parents
     title: str
-    url: str
+    fields: Dict[str, str]
+
+    # written out as a field default would conflict with __slots__
+    def __init__(self, group, name, parents, title, fields=None):
+        """Create a note sharing interned group and parents."""
+        self.group = sys.intern(group)
+        self.name = name
+        self.parents = intern_parents(parents)
+        self.title = title
+        self.fields = fields or _NO_FIELDS
+
+    @classmethod
+    def from_path(cls, root_dir, path, max_bytes=util.TITLE_MAX_BYTES):
+        """Create a node class from a Path() object.
+
+        max_bytes of the note are read for its title before the rest.
+        """
+        return cls._from_head(root_dir, path,
+                              *util.read_head(path, max_bytes=max_bytes))
+
+    @classmethod
+    def from_text(cls, root_dir, path, text):
+        """Create a node class from the text already read from path."""
+        return cls._from_head(root_dir, path, *util.parse_head(path, text))
 
     @classmethod
-    def from_path(cls, root_dir, path):
-        """Create a node class from a Path() object."""
+    def _from_head(cls, root_dir, path, title, fields):
         target = path.relative_to(root_dir)
 
         group = capwords(util.parse_stem(path.stem).replace('_', ' '))
         name = path.name
-        parents = list(target.parts[:-1])
-        title = util.get_title(path)
-        url = f'/{target.parent}/{target.stem}'
+        parents = target.parts[:-1]
 
-        return cls(group, name, parents, title, url)
+        return cls(group, name, parents, title, fields)
 
     @property
     def parent_path(self):
         """Return a relative path of note."""
-        return '/'.join(self.parents)
+        return self.parents.path
+
+    @property
+    def url(self):
+        """Return the note document path used in the index."""
+        stem = self.name.rpartition('.')[0] or self.name
+
+        return f'/{self.parents.path or "."}/{stem}'
+
+
+@dataclasses.dataclass
+class Section:
+    """A notebook section compiled for rendering."""
+
+    title: str
+    depth: int
+    header: str
+    columns: List[str]
+    rows: List[List[Optional[Node]]]
+    path: str = ''
+
+    @classmethod
+    def from_node(cls, node, table_columns=None):
+        """Create a section from a tree node in a single pass over notes.
+
+        Ungrouped sections are laid out in table_columns columns, defaulting
+        to the table_columns meta data of the node or TABLE_COLUMNS.
+        """
+        notes = sort_notes(node.notes, getattr(node, 'sort_by', None))
+        group_by = getattr(node, 'group_by', None)
+        buckets = {}
+
+        for note in notes:
+            buckets.setdefault(get_group(note, group_by), []).append(note)
+
+        group_order = get_group_order(node, buckets)
+
+        if group_order:
+            cols = [buckets.get(x, []) for x in group_order]
+            rows = [list(x) for x in zip_longest(*cols, fillvalue=None)]
+
+        else:
+            width = table_columns or getattr(node, 'table_columns',
+                                             TABLE_COLUMNS)
+            rows = [notes[i:i + width] for i in range(0, len(notes), width)]
+
+            if rows:
+                rows[-1].extend([None] * (width - len(rows[-1])))
+
+        return cls(title=node.title,
+                   depth=node.depth,
+                   header=getattr(node, 'header', ''),
+                   columns=get_column_names(node, group_order),
+                   rows=rows,
+                   path='/'.join(x.name for x in node.path[1:]))
@@ -1,7 +1,5 @@
 """Template Filters."""
-from itertools import groupby, zip_longest
-
-from jinja2.filters import do_batch
+from .data import Section
 
 
 def format_rst(cell):
@@ -14,18 +12,18 @@ def format_rst(cell):
 
 def table_header(node):
     """Return table header row."""
+    if isinstance(node, Section):
+        return node.columns
+
     return node.groups()
 
 
-def table_body(node):
-    """Return table rows."""
-    if not node.groups():
-        return do_batch(node.notes, 4, fill_with="")
+def table_body(node, columns=None):
+    """Return table rows.
 
-    notes = {
-        key: list(value)
-        for key, value in groupby(node.notes, lambda x: x.group)
-    }
-    cols = [notes[x] for x in node.groups(overide_names=False)]
+    columns sets the width of ungrouped tables of tree nodes.
+    """
+    if isinstance(node, Section):
+        return node.rows
 
-    return zip_longest(*cols, fillvalue=None)
+    return Section.from_node(node, columns).rows
@@ -0,0 +1,264 @@
+"""Notebook files listed from the git index.
+
+Tracked files are keyed by the blob hash recorded in the index, so a scan
+cache can tell unchanged notes apart without reading or hashing them.
+Files modified in the working tree and untracked files have no valid blob
+and are keyed by their file state as in a plain walk.
+"""
+import os
+import re
+import struct
+import subprocess
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+ENTRY = struct.Struct('>10I')
+FILE_MODES = (0o100644, 0o100755)
+
+# Hash size in bytes of each object format, set by extensions.objectformat.
+HASH_SIZES = {'sha1': 20, 'sha256': 32}
+
+CONFIG_SECTION_RE = re.compile(r'\s*\[([^\]]*)\]')
+CONFIG_VALUE_RE = re.compile(r'\s*([\w-]+)\s*=\s*"?([^"#;\s]*)"?')
+
+
+class Listing:
+    """Files below a notebook found in the git index."""
+
+    def __init__(self, blobs: Dict[str, str], dirty: Set[str]):
+        """Create a listing of blob hashes and dirty paths."""
+        self.blobs = blobs
+        self.dirty = dirty
+
+    @property
+    def paths(self):
+        """Return all listed paths relative to the notebook."""
+        return set(self.blobs) | self.dirty
+
+    def keys(self) -> Dict[str, str]:
+        """Return blob hashes of tracked files unchanged in the work tree."""
+        return {x: y for x, y in self.blobs.items() if x not in self.dirty}
+
+
+def _split(output: bytes):
+    return [os.fsdecode(x) for x in output.split(b'\0') if x]
+
+
+def _git(root_dir: Path, *args) -> bytes:
+    return subprocess.run(['git', *args],
+                          cwd=root_dir,
+                          check=True,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL,
+                          env={
+                              **os.environ, 'GIT_OPTIONAL_LOCKS': '0'
+                          }).stdout
+
+
+def ls_files(root_dir: Path) -> Listing:
+    """List files with the git command, including untracked ones.
+
+    Tracked files deleted from the work tree are not listed.
+    """
+    deleted = set(_split(_git(root_dir, 'ls-files', '-z', '-d')))
+    blobs = {}
+
+    for line in _split(_git(root_dir, 'ls-files', '-s', '-z')):
+        info, path = line.split('\t', 1)
+        mode, blob, stage = info.split()
+
+        if stage == '0' and int(mode, 8) in FILE_MODES and path not in deleted:
+            blobs[path] = blob
+
+    dirty = set(
+        _split(
+            _git(root_dir, 'ls-files', '-z', '-m', '-o',
+                 '--exclude-standard'))) - deleted
+
+    return Listing(blobs, dirty)
+
+
+def find_git_dir(root_dir: Path) -> Optional[tuple]:
+    """Return the git directory and work tree containing root_dir."""
+    top = Path(root_dir).resolve()
+
+    for path in (top, *top.parents):
+        dot_git = path / '.git'
+
+        if dot_git.is_dir():
+            return dot_git, path
+
+        if dot_git.is_file():
+            text = dot_git.read_text(encoding='utf-8').strip()
+
+            if text.startswith('gitdir:'):
+                return (path / text[len('gitdir:'):].strip()).resolve(), path
+
+    return None
+
+
+def _read_varint(data: bytes, offset: int) -> tuple:
+    """Read a git offset varint."""
+    byte = data[offset]
+    value = byte & 0x7f
+    offset += 1
+
+    while byte & 0x80:
+        byte = data[offset]
+        value = ((value + 1) << 7) | (byte & 0x7f)
+        offset += 1
+
+    return value, offset
+
+
+def get_hash_size(git_dir: Path) -> int:
+    """Return the object hash size of a repository from its config.
+
+    Raise ValueError for an unknown extensions.objectformat.
+    """
+    try:
+        text = (git_dir / 'config').read_text(encoding='utf-8')
+
+    except FileNotFoundError:
+        text = ''
+
+    section = ''
+    object_format = 'sha1'
+
+    for line in text.splitlines():
+        match = CONFIG_SECTION_RE.match(line)
+
+        if match:
+            section = match.group(1).strip().lower()
+            line = line[match.end():]
+
+        match = CONFIG_VALUE_RE.match(line)
+
+        if (match and section == 'extensions'
+                and match.group(1).lower() == 'objectformat'):
+            object_format = match.group(2).lower()
+
+    if object_format not in HASH_SIZES:
+        raise ValueError(f'{git_dir}: unknown object format {object_format}')
+
+    return HASH_SIZES[object_format]
+
+
+def _read_name(data: bytes, offset: int, start: int, version: int,
+               name: bytes) -> tuple:
+    """Read the path of an index entry starting at start.
+
+    name is the path of the previous entry, which version 4 paths are
+    compressed against. Return the path and the offset of the next entry.
+    """
+    if version == 4:
+        strip, offset = _read_varint(data, offset)
+        end = data.index(b'\0', offset)
+        return name[:len(name) - strip] + data[offset:end], end + 1
+
+    end = data.index(b'\0', offset)
+    return data[offset:end], start + ((end - start) // 8 + 1) * 8
+
+
+def read_index(path: Path, hash_size: int = 20):
+    """Yield (path, mode, blob, stage, mtime_ns, size) from a git index.
+
+    Raise ValueError if the index is not valid, eg read with the wrong
+    hash_size.
+    """
+    data = Path(path).read_bytes()
+
+    if data[:4] != b'DIRC':
+        raise ValueError(f'{path}: not a git index')
+
+    version, count = struct.unpack('>II', data[4:12])
+
+    if version not in (2, 3, 4):
+        raise ValueError(f'{path}: unsupported index version {version}')
+
+    offset = 12
+    name = b''
+
+    for _ in range(count):
+        start = offset
+        offset += ENTRY.size + hash_size + 2
+
+        if offset > len(data):
+            raise ValueError(f'{path}: truncated git index')
+
+        (_, _, mtime_s, mtime_ns, _, _, mode, _, _,
+         size) = ENTRY.unpack_from(data, start)
+        blob = data[start + ENTRY.size:offset - 2].hex()
+        flags, = struct.unpack_from('>H', data, offset - 2)
+
+        if flags & 0x4000:
+            offset += 2
+
+        name, offset = _read_name(data, offset, start, version, name)
+
+        if not name or flags & 0xfff != min(len(name), 0xfff):
+            raise ValueError(f'{path}: invalid index entry')
+
+        yield (os.fsdecode(name), mode, blob, (flags >> 12) & 3,
+               mtime_s * 1_000_000_000 + mtime_ns, size)
+
+
+def parse_index(root_dir: Path) -> Optional[Listing]:
+    """List tracked files by reading the git index file directly.
+
+    Used when the git command is unavailable. Files whose mtime or size
+    differ from the index are dirty; untracked files are not listed. Raise
+    ValueError if the index cannot be read.
+    """
+    found = find_git_dir(root_dir)
+
+    if not found:
+        return None
+
+    git_dir, work_tree = found
+    prefix = Path(root_dir).resolve().relative_to(work_tree).as_posix()
+    prefix = '' if prefix == '.' else f'{prefix}/'
+    blobs = {}
+    dirty = set()
+
+    for path, mode, blob, stage, mtime_ns, size in read_index(
+            git_dir / 'index', get_hash_size(git_dir)):
+        if not path.startswith(prefix) or mode not in FILE_MODES:
+            continue
+
+        rel_path = path[len(prefix):]
+
+        try:
+            stat = (work_tree / path).stat()
+
+        except FileNotFoundError:
+            continue
+
+        if stage:
+            dirty.add(rel_path)
+            continue
+
+        blobs[rel_path] = blob
+
+        if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+            dirty.add(rel_path)
+
+    return Listing(blobs, dirty)
+
+
+def list_files(root_dir: Path) -> Optional[Listing]:
+    """Return files of a notebook from git, or None outside a repository."""
+    try:
+        return ls_files(root_dir)
+
+    except FileNotFoundError:
+        pass  # no git command
+
+    except subprocess.CalledProcessError:
+        return None  # not a repository
+
+    try:
+        return parse_index(root_dir)
+
+    except (OSError, ValueError):
+        return None
@@ -1,77 +1,581 @@
 """Main module."""
+import contextlib
+import csv
+import dataclasses
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import IO, List
+from typing import (IO, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Set, Tuple)
 
-import anytree
 import jinja2
-import nanoid
+import yaml
 
-from . import data
+from . import data, filters, gitindex, util, walk
+from .cache import ScanCache
+from .search import SearchIndex
+from .targets import TargetIndex
+from .timings import Timings, phase
+from .util import NANOID_ALPHABET, NANOID_SIZE, get_target  # pylint: disable=unused-import
 
-NANOID_ALPHABET = '-0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
-NANOID_SIZE = 10
+# Manifest values that must be strings when they are set.
+MANIFEST_STRINGS = ('path', 'title', 'template', 'note_id')
+
+
+class ScanError(Exception):
+    """One or more notebook files could not be read."""
+
+    def __init__(self, failures):
+        """Create an error from (path, error) pairs."""
+        self.failures = failures
+        super().__init__(f'{len(failures)} file(s) could not be read')
+
+
+@dataclasses.dataclass
+class ScanOptions:
+    """Caches, indexes and threads used to read the files of a notebook.
+
+    Notes read are added to the targets and search indexes. Files are read
+    by executor when one is given, see thread_pool. With git, files are
+    listed from the git index and the cache is keyed by blob hash. The
+    first title_max_bytes of a note are read for its title before the rest.
+    """
+
+    cache: Optional[ScanCache] = None
+    targets: Optional[TargetIndex] = None
+    search: Optional[SearchIndex] = None
+    timings: Optional[Timings] = None
+    executor: Optional[ThreadPoolExecutor] = None
+    git: bool = False
+    title_max_bytes: Optional[int] = util.TITLE_MAX_BYTES
+
+    @property
+    def indexes(self) -> List:
+        """Return the targets and search indexes given."""
+        return [x for x in (self.targets, self.search) if x is not None]
+
+
+@contextlib.contextmanager
+def thread_pool(jobs: int) -> Iterator[Optional[ThreadPoolExecutor]]:
+    """Yield a pool of jobs threads, or None to read files serially."""
+    if jobs <= 1:
+        yield None
+        return
+
+    with ThreadPoolExecutor(jobs) as executor:
+        yield executor
+
+
+def scan_files(func: Callable, root_dir: Path, paths: Iterable[Path],
+               executor: Optional[ThreadPoolExecutor]) -> list:
+    """Apply func to each path, collecting per file failures."""
+
+    def _apply(path):
+        try:
+            return func(root_dir, path), None
+
+        except Exception as error:  # pylint: disable=broad-except
+            return None, (path, error)
+
+    if executor:
+        results = list(executor.map(_apply, paths))
+
+    else:
+        results = [_apply(x) for x in paths]
+
+    failures = [error for _, error in results if error]
+
+    if failures:
+        raise ScanError(failures)
+
+    return [value for value, _ in results]
 
 
 def get_notes(
     root_dir: Path,
+    walk_options: Optional[walk.WalkOptions] = None,
+    *,
+    options: Optional[ScanOptions] = None,
+    subdir: str = ''
+) -> (List[data.Note], List[data.MetaData]):
+    """Return notes and meta data from notebook.
+
+    The notebook is walked once in sorted order with walk_options, see
+    walk.WalkOptions for the files skipped. With options.git, files are
+    listed from the git index instead; outside a repository the notebook
+    is walked. subdir limits the scan to a directory relative to root_dir.
+    """
+    options = options or ScanOptions()
+    paths = {walk.NOTE: [], walk.META: []}
+
+    with phase(options.timings, 'walk'):
+        for kind, path in find_files(root_dir,
+                                     walk_options,
+                                     cache=options.cache,
+                                     git=options.git,
+                                     subdir=subdir):
+            paths[kind].append(path)
+
+    return read_notes(root_dir,
+                      paths[walk.NOTE],
+                      paths[walk.META],
+                      options=options,
+                      subdir=subdir)
+
+
+def find_files(root_dir: Path,
+               walk_options: Optional[walk.WalkOptions] = None,
+               *,
+               cache: Optional[ScanCache] = None,
+               git: bool = False,
+               subdir: str = '') -> Iterator[Tuple[str, Path]]:
+    """Return an iterator of (kind, path) for notes and meta data.
+
+    Files are walked with walk_options, or listed from the git index with
+    git, in which case the cache is keyed by their blob hash.
+    """
+    listing = gitindex.list_files(root_dir) if git else None
+
+    if listing is None:
+        return walk.walk(root_dir, walk_options, subdir=subdir)
+
+    if cache:
+        cache.keys = listing.keys()
+
+    prefix = f'{subdir}/' if subdir else ''
+
+    return walk.filter_paths(
+        root_dir, [x for x in listing.paths if x.startswith(prefix)],
+        walk_options)
+
+
+def get_readers(options: ScanOptions) -> Tuple[Callable, Callable]:
+    """Return note and meta data readers using the cache and indexes given.
+
+    Notes read are also added to the targets and search indexes.
+    """
+    cache = options.cache
+    note_from_path = functools.partial(
+        cache.note if cache else data.Note.from_path,
+        max_bytes=options.title_max_bytes)
+    meta_from_yaml = cache.meta_data if cache else data.MetaData.from_yaml
+
+    if options.indexes:
+        read_note = note_from_path
+
+        def read_and_index(root_dir, path):
+            note = read_note(root_dir, path)
+
+            if options.targets is not None:
+                options.targets.update_file(root_dir, path)
+
+            if options.search is not None:
+                options.search.update_file(root_dir, path, note)
+
+            return note
+
+        note_from_path = read_and_index
+
+    if options.timings:
+        note_from_path = options.timings.track(note_from_path)
+        meta_from_yaml = options.timings.track(meta_from_yaml)
+
+    return note_from_path, meta_from_yaml
+
+
+def read_notes(
+    root_dir: Path,
+    note_paths: List[Path],
+    meta_paths: List[Path],
     *,
-    filter_: str = '_include',
-    note_pattern: str = '**/*.rst',
-    meta_pattern: str = '**/_meta.yaml'
+    options: Optional[ScanOptions] = None,
+    subdir: str = ''
 ) -> (List[data.Note], List[data.MetaData]):
-    """Return notes and meta data from notebook."""
-    notes = [
-        data.Note.from_path(root_dir, x)
-        for x in sorted(root_dir.glob(note_pattern)) if filter_ not in x.parts
-    ]
+    """Return notes and meta data read from files in the notebook.
+
+    Files are read by options.executor when one is given; the result order
+    is the same as a serial scan. Files that fail to parse are collected
+    and raised together as a ScanError. The targets and search indexes,
+    when given, are updated from the same notes, pruning only notes below
+    subdir when the files are from a scan of subdir.
+    """
+    options = options or ScanOptions()
+    timings = options.timings
+    note_from_path, meta_from_yaml = get_readers(options)
 
-    meta_data = [
-        data.MetaData.from_yaml(root_dir, x)
-        for x in root_dir.glob(meta_pattern)
-    ]
+    if options.indexes:
+        rel_paths = [x.relative_to(root_dir).as_posix() for x in note_paths]
+
+        for index in options.indexes:
+            index.prune(rel_paths, subdir)
+
+    if timings:
+        timings.count('files_visited', len(note_paths) + len(meta_paths))
+
+    with phase(timings, 'notes'):
+        notes = scan_files(note_from_path, root_dir, note_paths,
+                           options.executor)
+
+    with phase(timings, 'meta'):
+        meta_data = scan_files(meta_from_yaml, root_dir, meta_paths,
+                               options.executor)
 
     return (notes, meta_data)
 
 
-def get_target() -> str:
-    """Create a random target ID."""
-    return nanoid.generate(NANOID_ALPHABET, NANOID_SIZE)
+def get_environment(template_dir: Optional[str] = None,
+                    cache_dir: Optional[Path] = None) -> jinja2.Environment:
+    """Return a template environment with the notebook filters.
+
+    Compiled templates are kept in cache_dir, when given, so later
+    processes skip parsing and compiling them.
+    """
+    if template_dir:
+        loader = jinja2.FileSystemLoader(template_dir)
+
+    else:
+        loader = jinja2.PackageLoader('sphinx_notebook')
+
+    bytecode_cache = None
+
+    if cache_dir:
+        try:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(str(cache_dir))
+
+        except OSError:
+            pass
+
+    env = jinja2.Environment(loader=loader,
+                             autoescape=jinja2.select_autoescape(),
+                             trim_blocks=True,
+                             bytecode_cache=bytecode_cache)
+    env.filters['format_rst'] = filters.format_rst
+    env.filters['table_header'] = filters.table_header
+    env.filters['table_body'] = filters.table_body
+
+    return env
+
+
+def get_index_meta(meta_data: List[data.MetaData]) -> data.MetaData:
+    """Return meta data for the notebook root."""
+    for override in meta_data:
+        if override.path == '.':
+            return override
+
+    return data.MetaData('.')
 
 
 def to_tree(notes: List[data.Note],
             meta_data: List[data.MetaData]) -> data.Node:
     """Get a tree of notes from a list of notes and override meta data."""
     root = data.Node('root')
-    resolver = anytree.resolver.Resolver()
+    sections = {'': root}
 
     for note in notes:
-        root.add_note(note)
+        parent = sections.get(note.parent_path)
 
-    for override in meta_data:
-        node = resolver.get(root, override.path)
-        node.update(override.to_dict())
+        if parent is None:
+            parent = root.add_parents(note.parents)
+            sections[note.parent_path] = parent
+
+        parent.append_note(note)
+
+    apply_meta(root, meta_data)
 
     return root
 
 
-def render_index(root: anytree.Node, title: str, header: str,
+def cascade_meta(override: Optional[data.MetaData],
+                 inherited: dict) -> Tuple[dict, dict]:
+    """Return the settings of a section and those cascaded to its children.
+
+    The section gets override on top of inherited, the settings cascaded
+    from its ancestors; empty values do not replace cascaded ones.
+    """
+    if not override:
+        return inherited, inherited
+
+    own = {
+        x: y
+        for x, y in override.to_dict().items() if y or x not in inherited
+    }
+
+    return {
+        **inherited,
+        **own
+    }, {
+        **inherited,
+        **{x: own[x]
+           for x in override.cascade if x in own}
+    }
+
+
+def merge_meta(node: data.Node, override: Optional[data.MetaData],
+               inherited: dict) -> dict:
+    """Apply meta data on top of cascaded settings to a node.
+
+    The directory of the override is kept as node.meta_path. Return the
+    settings cascaded to its children.
+    """
+    settings, inherited = cascade_meta(override, inherited)
+    node.update(settings)
+
+    if override:
+        node.meta_path = override.path
+
+    return inherited
+
+
+def apply_meta(root: data.Node, meta_data: List[data.MetaData]) -> None:
+    """Apply meta data overrides to sections in one top-down pass.
+
+    Each section gets the settings of its own meta data file on top of those
+    cascaded from its ancestors, empty values do not replace cascaded ones.
+    Overrides for missing sections are ignored.
+    """
+    overrides = {('' if x.path == '.' else x.path): x for x in meta_data}
+    stack = [(root, '', {})]
+
+    while stack:
+        node, path, inherited = stack.pop()
+        inherited = merge_meta(node, overrides.get(path), inherited)
+
+        for child in node.children:
+            if not child.is_leaf:
+                stack.append((child, f'{path}/{child.name}' if path else
+                              child.name, inherited))
+
+
+def get_sections(root: data.Node) -> List[data.Section]:
+    """Return sections compiled for rendering in pre-order."""
+    sections = []
+    stack = [x for x in reversed(root.children) if not x.is_leaf]
+
+    while stack:
+        node = stack.pop()
+        sections.append(data.Section.from_node(node))
+        stack.extend(x for x in reversed(node.children) if not x.is_leaf)
+
+    return sections
+
+
+def render_index(root: data.Node, title: str, header: str,
                  template: jinja2.Template, out: IO[str]) -> None:
     """Render notebook tree into index.rst."""
-    ctx = {
-        'title':
-        title,
-        'header':
-        header,
-        'nodes': [
-            node for node in anytree.PreOrderIter(root)
-            if node.depth and not node.is_leaf
-        ]
-    }
+    ctx = {'title': title, 'header': header, 'nodes': get_sections(root)}
 
     out.write(template.render(ctx))
 
 
-def render_note(template: jinja2.Template, out: IO[str]) -> None:
-    """Render a single note for export."""
-    note_id = get_target()
-    out.write(template.render(note_id=note_id))
+def _enter_dir(stack: List[list], rel_dir: str,
+               override: Optional[data.MetaData]) -> data.Node:
+    """Move the stack of open sections to rel_dir and return its node.
+
+    Sections that rel_dir is not below are closed and the missing ones down
+    to rel_dir are opened, the deepest with the meta data override.
+    """
+    while len(stack) > 1 and not rel_dir.startswith(f'{stack[-1][1]}/'):
+        stack.pop()[0].parent = None
+
+    node, path, cascaded, _ = stack[-1]
+    parts = rel_dir[len(path):].strip('/').split('/') if rel_dir else []
+
+    if not parts:
+        stack[0][2] = merge_meta(node, override, {})
+
+    for i, part in enumerate(parts, start=1):
+        path = f'{path}/{part}' if path else part
+        node = data.Node(part, node, title=util.to_title_case(part))
+        cascaded = merge_meta(node, override if i == len(parts) else None,
+                              cascaded)
+        stack.append([node, path, cascaded, False])
+
+    return node
+
+
+def iter_sections(
+    dirs: Iterable[Tuple[str, List[data.Note], List[data.MetaData]]],
+    visit: Optional[Callable[[data.Node], None]] = None
+) -> Iterator[data.Section]:
+    """Yield sections in pre-order from notes read directory by directory.
+
+    dirs are (rel_dir, notes, meta_data) in pre-order with the files of a
+    directory before its subdirectories. A section is yielded once a note
+    below it is read and only the sections above the current directory are
+    kept. visit is called with each node rendered, the root last.
+    """
+    root = data.Node('root')
+    stack = [[root, '', {}, True]]  # node, rel_dir, cascaded, rendered
+
+    for rel_dir, notes, meta_data in dirs:
+        node = _enter_dir(stack, rel_dir, meta_data[0] if meta_data else None)
+
+        for note in notes:
+            node.append_note(note)
+
+        if not notes:
+            continue
+
+        for entry in stack:
+            if not entry[3]:
+                entry[3] = True
+
+                if visit:
+                    visit(entry[0])
+
+                yield data.Section.from_node(entry[0])
+
+    if visit:
+        visit(root)
+
+
+def render_note(template: jinja2.Template, out: IO[str], **ctx) -> None:
+    """Render a single note for export.
+
+    A note_id is generated unless one is given in ctx.
+    """
+    ctx.setdefault('note_id', get_target())
+    out.write(template.render(ctx))
+
+
+def read_note_manifest(path: Path) -> List[dict]:
+    """Return note entries from a YAML or CSV manifest.
+
+    Each entry needs a path and may set a title, a template and any other
+    value passed on to the note template.
+    """
+    with path.open(encoding='utf-8', newline='') as fd_in:
+        if path.suffix.lower() == '.csv':
+            entries = [
+                {x: y for x, y in row.items() if y}
+                for row in csv.DictReader(fd_in)
+            ]
+
+        else:
+            entries = yaml.safe_load(fd_in) or []
+
+    if not isinstance(entries, list):
+        raise ValueError(f'{path}: expected a list of notes')
+
+    for index, entry in enumerate(entries, start=1):
+        if not isinstance(entry, dict) or not entry.get('path'):
+            raise ValueError(f'{path}: note {index} has no path')
+
+        for key in MANIFEST_STRINGS:
+            if entry.get(key) is not None and not isinstance(entry[key], str):
+                raise ValueError(f'{path}: note {index} {key} is not a '
+                                 'string, quote it')
+
+    return entries
+
+
+def _given_note_ids(entries: Dict[Path, dict],
+                    targets: Optional[TargetIndex] = None) -> Set[str]:
+    """Return the note IDs given by entries, checking they are unused."""
+    note_ids = set()
+
+    for path, entry in entries.items():
+        note_id = entry.get('note_id')
+
+        if not note_id:
+            continue
+
+        if note_id in note_ids:
+            raise ValueError(f'{path}: note_id {note_id} given twice')
+
+        if targets is not None and targets.lookup(note_id):
+            raise ValueError(f'{path}: target {note_id} already exists')
+
+        note_ids.add(note_id)
+
+    return note_ids
+
+
+def _pending_notes(entries: List[dict], root_dir: Path,
+                   skip_existing: bool) -> Tuple[Dict[Path, dict], List[Path]]:
+    """Return manifest entries by note path and the paths skipped.
+
+    Raise FileExistsError for an existing or duplicated path unless
+    skip_existing is set.
+    """
+    pending = {}
+    skipped = []
+
+    for entry in entries:
+        entry = dict(entry)
+        path = root_dir / entry.pop('path')
+
+        if path in pending or path.exists():
+            if not skip_existing:
+                raise FileExistsError(f'{path}: file exists')
+
+            skipped.append(path)
+            continue
+
+        pending[path] = entry
+
+    return pending, skipped
+
+
+def _write_notes(notes: Dict[Path, str], keep: bool) -> List[Path]:
+    """Create note files, removing those created if a write fails.
+
+    With keep, notes created before a failure are left in place.
+    """
+    for parent in {x.parent for x in notes}:
+        parent.mkdir(parents=True, exist_ok=True)
+
+    created = []
+
+    try:
+        for path, text in notes.items():
+            with path.open(encoding='utf-8', mode='x') as out:
+                created.append(path)
+                out.write(text)
+
+    except BaseException:
+        if not keep:
+            for path in created:
+                path.unlink()
+
+        raise
+
+    return created
+
+
+def create_notes(entries: List[dict],  # pylint: disable=too-many-arguments
+                 get_template: Callable[[str], jinja2.Template],
+                 *,
+                 root_dir: Path = Path('.'),
+                 template_name: str = 'note.rst.jinja',
+                 skip_existing: bool = False,
+                 targets: Optional[TargetIndex] = None
+                 ) -> (List[Path], List[Path]):
+    """Create many notes from manifest entries in one pass.
+
+    All notes are rendered before any file is written. Unless skip_existing
+    is set, an existing or duplicated path fails the batch before anything
+    is written, and files already created are removed if a write fails.
+    A note_id given twice in the batch fails it too, and with a targets
+    index so does one already used in the notebook. Generated note IDs are
+    unique in the batch and, with a targets index, in the notebook. Return
+    the paths created and skipped.
+    """
+    pending, skipped = _pending_notes(entries, root_dir, skip_existing)
+    note_ids = _given_note_ids(pending, targets)
+    new_target = targets.new_target if targets else get_target
+    notes = {}
+
+    for path, entry in pending.items():
+        note_id = entry.pop('note_id', None)
+
+        while not note_id or note_id in note_ids:
+            note_id = new_target()
+
+        note_ids.add(note_id)
+
+        template = get_template(entry.pop('template', None) or template_name)
+        notes[path] = template.render(entry, note_id=note_id)
+
+    return (_write_notes(notes, skip_existing), skipped)
@@ -0,0 +1,246 @@
+"""Notebook search index."""
+import bisect
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import data, util, walk
+
+INDEX_VERSION = 1
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+# Weight of a term by where it was found in a note.
+WEIGHTS = {'title': 8, 'group': 4, 'section': 2, 'body': 1}
+
+
+def tokenize(text: str) -> List[str]:
+    """Return lower case word tokens of text."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def get_index_path(root_dir: Path) -> Path:
+    """Return the default search index location for a notebook."""
+    return util.get_notebook_cache('search', root_dir)
+
+
+def get_terms(note: data.Note,
+              path: Optional[Path] = None) -> Dict[str, int]:
+    """Return the terms of a note with their weight.
+
+    Body terms are only read when path is given.
+    """
+    fields = [('body', path.read_text(encoding='utf-8', errors='replace')
+               if path else ''), ('section', ' '.join(note.parents)),
+              ('group', note.group), ('title', note.title)]
+    terms = {}
+
+    for field, text in fields:
+        for term in tokenize(text):
+            terms[term] = WEIGHTS[field]
+
+    return terms
+
+
+class SearchIndex:  # pylint: disable=too-many-instance-attributes
+    """Inverted index of note titles, groups, sections and body terms."""
+
+    def __init__(self, path: Path, root_dir: Path, *, body: bool = False):
+        """Create an empty index of a notebook, with note bodies if body."""
+        self.path = Path(path)
+        self.root = str(Path(root_dir).resolve())
+        self.body = body
+        self.docs = {}
+        self.postings = {}
+        self._terms = {}  # rel_path: terms, built on first change after load
+        self._vocabulary = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls,
+             path: Path,
+             root_dir: Path,
+             *,
+             body: Optional[bool] = None) -> 'SearchIndex':
+        """Load an index, returning an empty one if it is missing or stale.
+
+        body defaults to the setting the index was saved with.
+        """
+        try:
+            with Path(path).open(encoding='utf-8') as fd_in:
+                stored = json.load(fd_in)
+
+        except (OSError, ValueError):
+            stored = {}
+
+        if body is None:
+            body = stored.get('body', False)
+
+        index = cls(path, root_dir, body=body)
+
+        if (stored.get('version') != INDEX_VERSION
+                or stored.get('root') != index.root
+                or stored.get('body') != body):
+            return index
+
+        docs = stored.get('docs', [])
+
+        for rel_path, mtime_ns, size, title, group in docs:
+            index.docs[rel_path] = {
+                'state': [mtime_ns, size],
+                'title': title,
+                'group': group
+            }
+
+        for term, hits in stored.get('postings', {}).items():
+            index.postings[term] = {docs[x][0]: y for x, y in hits}
+
+        index._terms = None
+
+        return index
+
+    @property
+    def exists(self) -> bool:
+        """Return True if the index has been saved."""
+        return self.path.exists()
+
+    def _forward(self):
+        if self._terms is None:
+            self._terms = {x: {} for x in self.docs}
+
+            for term, hits in self.postings.items():
+                for rel_path, weight in hits.items():
+                    self._terms[rel_path][term] = weight
+
+        return self._terms
+
+    def _drop(self, rel_path):
+        terms = self._forward().pop(rel_path, {})
+        self.docs.pop(rel_path, None)
+
+        for term in terms:
+            hits = self.postings[term]
+            hits.pop(rel_path, None)
+
+            if not hits:
+                del self.postings[term]
+                self._vocabulary = None
+
+    def update_file(self,
+                    root_dir: Path,
+                    path: Path,
+                    note: Optional[data.Note] = None) -> None:
+        """Re-index a note if it changed since it was indexed."""
+        rel_path = path.relative_to(root_dir).as_posix()
+        stat = path.stat()
+        state = [stat.st_mtime_ns, stat.st_size]
+        doc = self.docs.get(rel_path)
+
+        if doc and doc['state'] == state:
+            return
+
+        if note is None:
+            note = data.Note.from_path(root_dir, path)
+
+        terms = get_terms(note, path if self.body else None)
+
+        with self._lock:
+            self._drop(rel_path)
+            self.docs[rel_path] = {
+                'state': state,
+                'title': note.title,
+                'group': note.group
+            }
+            self._forward()[rel_path] = terms
+
+            for term, weight in terms.items():
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    self._vocabulary = None
+
+                self.postings[term][rel_path] = weight
+
+    def prune(self, rel_paths: Iterable[str], subdir: str = '') -> None:
+        """Drop notes that are not in rel_paths, only below subdir if given."""
+        prefix = f'{subdir}/' if subdir else ''
+
+        for rel_path in set(self.docs) - set(rel_paths):
+            if rel_path.startswith(prefix):
+                self._drop(rel_path)
+
+    def refresh(self, root_dir: Path) -> None:
+        """Walk the notebook and re-index changed notes."""
+        rel_paths = []
+
+        for kind, path in walk.walk(root_dir):
+            if kind == walk.NOTE:
+                rel_paths.append(path.relative_to(root_dir).as_posix())
+                self.update_file(root_dir, path)
+
+        self.prune(rel_paths)
+
+    def _matches(self, token: str) -> Dict[str, int]:
+        """Return the best weight per note of terms starting with token."""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+
+        vocabulary = self._vocabulary
+        matches = {}
+        i = bisect.bisect_left(vocabulary, token)
+
+        while i < len(vocabulary) and vocabulary[i].startswith(token):
+            term = vocabulary[i]
+            # prefer whole words to prefixes
+            scale = 2 if term == token else 1
+
+            for rel_path, weight in self.postings[term].items():
+                matches[rel_path] = max(matches.get(rel_path, 0),
+                                        weight * scale)
+
+            i += 1
+
+        return matches
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[int, str]]:
+        """Return (score, note) of notes matching every word of query."""
+        scores = None
+
+        for token in tokenize(query):
+            matches = self._matches(token)
+
+            if scores is None:
+                scores = matches
+
+            else:
+                scores = {
+                    x: y + matches[x]
+                    for x, y in scores.items() if x in matches
+                }
+
+            if not scores:
+                return []
+
+        ranked = sorted(((y, x) for x, y in (scores or {}).items()),
+                        key=lambda x: (-x[0], x[1]))
+
+        return ranked[:limit]
+
+    def save(self) -> None:
+        """Write the index if it changed."""
+        ids = {x: i for i, x in enumerate(sorted(self.docs))}
+        stored = {
+            'version': INDEX_VERSION,
+            'root': self.root,
+            'body': self.body,
+            'docs': [[x, *self.docs[x]['state'], self.docs[x]['title'],
+                      self.docs[x]['group']] for x in ids],
+            'postings': {
+                x: sorted([ids[y], z] for y, z in self.postings[x].items())
+                for x in sorted(self.postings)
+            },
+        }
+
+        util.write_if_changed(self.path,
+                              json.dumps(stored, separators=(',', ':')) + '\n')
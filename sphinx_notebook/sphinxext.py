@@ -0,0 +1,156 @@
+"""Sphinx extension that renders the notebook index during the build.
+
+Add ``sphinx_notebook`` to ``extensions`` in ``conf.py``. The index is
+written when the builder starts if it does not exist, and afterwards only
+when Sphinx reports added, changed or removed notes or a ``_meta.yaml`` file
+changed.
+"""
+import os
+from pathlib import Path
+
+from sphinx.util import logging
+
+from . import builder, notebook, walk
+from .cache import ScanCache
+
+LOGGER = logging.getLogger(__name__)
+
+CONFIG_VALUES = {
+    'notebook_root': '',
+    'notebook_index': 'index',
+    'notebook_template': 'index.rst.jinja',
+    'notebook_template_dir': None,
+    'notebook_split_depth': 0,
+    'notebook_jobs': 1,
+}
+
+
+def _paths(app):
+    """Return notebook root directory and index path."""
+    srcdir = Path(app.srcdir)
+    root_dir = srcdir / app.config.notebook_root
+    dst = srcdir / f'{app.config.notebook_index}.rst'
+
+    return root_dir, dst
+
+
+def _docname(app, path):
+    """Return the Sphinx docname of an output path."""
+    return Path(os.path.relpath(path, app.srcdir)).with_suffix('').as_posix()
+
+
+def _meta_states(root_dir, meta_data):
+    """Return mtimes of the meta data files used for the index."""
+    states = {}
+
+    for meta in meta_data:
+        path = root_dir / meta.path / walk.META_FILE
+
+        try:
+            states[str(path)] = path.stat().st_mtime_ns
+
+        except FileNotFoundError:
+            pass
+
+    return states
+
+
+def _meta_changed(states):
+    """Return True if a recorded meta data file changed or was removed."""
+    for path, mtime_ns in states.items():
+        try:
+            if Path(path).stat().st_mtime_ns != mtime_ns:
+                return True
+
+        except FileNotFoundError:
+            return True
+
+    return False
+
+
+def generate(app):
+    """Render the notebook index into the Sphinx source directory."""
+    config = app.config
+    root_dir, dst = _paths(app)
+    cache = ScanCache(Path(app.doctreedir) / 'sphinx_notebook', root_dir)
+    walk_options = walk.WalkOptions(exclude=builder.get_outputs(
+        root_dir, dst, config.notebook_split_depth))
+
+    with notebook.thread_pool(config.notebook_jobs) as executor:
+        notes, meta_data = notebook.get_notes(
+            root_dir,
+            walk_options,
+            options=notebook.ScanOptions(cache=cache, executor=executor))
+
+    cache.save()
+
+    tree = notebook.to_tree(notes, meta_data)
+    index_meta = notebook.get_index_meta(meta_data)
+    template = notebook.get_environment(
+        config.notebook_template_dir).get_template(config.notebook_template)
+
+    build = builder.BuildOptions(template,
+                                 dst,
+                                 split_depth=config.notebook_split_depth)
+
+    if build.split_depth:
+        outputs = builder.render_shards(tree, index_meta, build)
+
+    else:
+        outputs = builder.write_index(tree, index_meta, build)
+
+    app.env.notebook_outputs = {_docname(app, x) for x in outputs}
+    app.env.notebook_meta = _meta_states(root_dir, meta_data)
+
+    LOGGER.info('sphinx_notebook: %s', cache.report())
+
+    return outputs
+
+
+def builder_inited(app):
+    """Render the index before Sphinx looks for source files."""
+    _, dst = _paths(app)
+
+    if not dst.exists() or not hasattr(app.env, 'notebook_outputs'):
+        generate(app)
+
+
+def env_get_outdated(app, env, added, changed, removed):
+    """Re-render the index if notes changed and return outdated outputs."""
+    root_dir, _ = _paths(app)
+    prefix = Path(os.path.relpath(root_dir, app.srcdir)).as_posix()
+    prefix = '' if prefix == '.' else f'{prefix}/'
+    generated = getattr(env, 'notebook_outputs', set())
+
+    notes = {
+        x
+        for x in added | changed | removed
+        if x.startswith(prefix) and x not in generated
+    }
+
+    if not notes and not _meta_changed(getattr(env, 'notebook_meta', {})):
+        return []
+
+    outputs = generate(app)
+    # shards may have been created or removed since Sphinx found its files
+    env.find_files(app.config, app.builder)
+
+    return [_docname(app, x) for x, y in outputs.items() if y['changed']]
+
+
+def setup(app):
+    """Register the extension with Sphinx.
+
+    The package setup adds its version to the metadata returned.
+    """
+    for name, default in CONFIG_VALUES.items():
+        app.add_config_value(name, default, 'env')
+
+    app.connect('builder-inited', builder_inited)
+    app.connect('env-get-outdated', env_get_outdated)
+
+    return {
+        'env_version': 1,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
@@ -0,0 +1,167 @@
+"""Notebook wide index of RST targets."""
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import util, walk
+
+INDEX_VERSION = 1
+
+TARGET_RE = re.compile(r'^\s*\.\. _(`[^`]+`|[^:`_][^:]*|_[^:_][^:]*):')
+
+
+def normalize(label: str) -> str:
+    """Return a label as compared by docutils and Sphinx."""
+    return ' '.join(label.lower().split())
+
+
+def get_index_path(root_dir: Path) -> Path:
+    """Return the default target index location for a notebook."""
+    return util.get_notebook_cache('targets', root_dir)
+
+
+def scan_targets(path: Path) -> List[Tuple[str, int]]:
+    """Return (label, line number) for each target defined in a note."""
+    targets = []
+
+    with path.open(encoding='utf-8', errors='replace') as fd_in:
+        for number, line in enumerate(fd_in, start=1):
+            if '.. _' not in line:
+                continue
+
+            match = TARGET_RE.match(line)
+
+            if match:
+                targets.append((match.group(1).strip('`'), number))
+
+    return targets
+
+
+class TargetIndex:
+    """Map of target labels to the notes and lines defining them."""
+
+    def __init__(self, path: Path, root_dir: Path):
+        """Create an empty index of a notebook stored at path."""
+        self.path = Path(path)
+        self.root = str(Path(root_dir).resolve())
+        self.files = {}
+        self.labels = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path, root_dir: Path) -> 'TargetIndex':
+        """Load an index, returning an empty one if it is missing or stale."""
+        index = cls(path, root_dir)
+
+        try:
+            with index.path.open(encoding='utf-8') as fd_in:
+                stored = json.load(fd_in)
+
+        except (OSError, ValueError):
+            return index
+
+        if stored.get('version') == INDEX_VERSION and stored.get(
+                'root') == index.root:
+            for rel_path, entry in stored.get('files', {}).items():
+                index._set(rel_path, entry['state'], entry['targets'])
+
+        return index
+
+    @property
+    def exists(self) -> bool:
+        """Return True if the index has been saved."""
+        return self.path.exists()
+
+    def _set(self, rel_path, state, targets):
+        self._drop(rel_path)
+        self.files[rel_path] = {'state': state, 'targets': targets}
+
+        for label, line in targets:
+            self.labels.setdefault(normalize(label), []).append(
+                (rel_path, line))
+
+    def _drop(self, rel_path):
+        entry = self.files.pop(rel_path, None)
+
+        if not entry:
+            return
+
+        for label in {normalize(x) for x, _ in entry['targets']}:
+            locations = [
+                x for x in self.labels.get(label, []) if x[0] != rel_path
+            ]
+
+            if locations:
+                self.labels[label] = locations
+
+            else:
+                self.labels.pop(label, None)
+
+    def update_file(self, root_dir: Path, path: Path) -> None:
+        """Rescan a note if it changed since it was indexed."""
+        rel_path = path.relative_to(root_dir).as_posix()
+        stat = path.stat()
+        state = [stat.st_mtime_ns, stat.st_size]
+        entry = self.files.get(rel_path)
+
+        if entry and entry['state'] == state:
+            return
+
+        targets = [list(x) for x in scan_targets(path)]
+
+        with self._lock:
+            self._set(rel_path, state, targets)
+
+    def prune(self, rel_paths: Iterable[str], subdir: str = '') -> None:
+        """Drop notes that are not in rel_paths, only below subdir if given."""
+        prefix = f'{subdir}/' if subdir else ''
+
+        for rel_path in set(self.files) - set(rel_paths):
+            if rel_path.startswith(prefix):
+                self._drop(rel_path)
+
+    def update(self, root_dir: Path, paths: Iterable[Path]) -> None:
+        """Bring the index in line with the notes at paths."""
+        rel_paths = []
+
+        for path in paths:
+            rel_paths.append(path.relative_to(root_dir).as_posix())
+            self.update_file(root_dir, path)
+
+        self.prune(rel_paths)
+
+    def refresh(self, root_dir: Path) -> None:
+        """Walk the notebook and update the index."""
+        self.update(root_dir, (path for kind, path in walk.walk(root_dir)
+                               if kind == walk.NOTE))
+
+    def lookup(self, label: str) -> List[Tuple[str, int]]:
+        """Return the notes and lines defining label."""
+        return list(self.labels.get(normalize(label), []))
+
+    def duplicates(self) -> Dict[str, List[Tuple[str, int]]]:
+        """Return labels defined more than once."""
+        return {x: y for x, y in self.labels.items() if len(y) > 1}
+
+    def new_target(self, rel_path: Optional[str] = None) -> str:
+        """Return a target ID not used in the notebook and reserve it."""
+        label = util.get_target()
+
+        while normalize(label) in self.labels:
+            label = util.get_target()
+
+        self.labels[normalize(label)] = [(rel_path, 1)]
+
+        return label
+
+    def save(self) -> None:
+        """Write the index if it changed."""
+        stored = {
+            'version': INDEX_VERSION,
+            'root': self.root,
+            'files': dict(sorted(self.files.items())),
+        }
+
+        util.write_if_changed(self.path, json.dumps(stored) + '\n')
@@ -0,0 +1,151 @@
+"""Per phase build instrumentation."""
+import contextlib
+import cProfile
+import heapq
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+
+def read_bytes() -> Optional[int]:
+    """Return bytes read by this process so far, where the OS reports it."""
+    try:
+        with open('/proc/self/io', encoding='ascii') as fd_in:
+            for line in fd_in:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+
+    except OSError:
+        pass
+
+    return None
+
+
+class Timings:
+    """Wall time, bytes read and counters of build phases.
+
+    Phases with the same name accumulate, so rendering many shards reports
+    a single render phase. The phase named by profile is run under cProfile.
+    """
+
+    def __init__(self, *, slowest: int = 10, profile: Optional[str] = None):
+        """Create empty timings."""
+        self.phases = {}
+        self.counters = {}
+        self.slowest = slowest
+        self.profile = profile
+        self.profiler = cProfile.Profile() if profile else None
+        self._files = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time the body of a with statement as phase name."""
+        profiler = self.profiler if name == self.profile else None
+        read_start = read_bytes()
+        start = time.perf_counter()
+
+        if profiler:
+            profiler.enable()
+
+        try:
+            yield self
+
+        finally:
+            if profiler:
+                profiler.disable()
+
+            elapsed = time.perf_counter() - start
+            read_end = read_bytes()
+            totals = self.phases.setdefault(name, {
+                'ms': 0.0,
+                'bytes_read': 0
+            })
+            totals['ms'] += elapsed * 1000
+
+            if read_start is not None and read_end is not None:
+                totals['bytes_read'] += read_end - read_start
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add value to counter name."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def track(self, func: Callable) -> Callable:
+        """Return func(root_dir, path) recording the time spent per file."""
+
+        def _track(root_dir, path):
+            start = time.perf_counter()
+
+            try:
+                return func(root_dir, path)
+
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                item = (elapsed, str(path.relative_to(root_dir)))
+
+                with self._lock:
+                    if len(self._files) < self.slowest:
+                        heapq.heappush(self._files, item)
+
+                    elif self.slowest:
+                        heapq.heappushpop(self._files, item)
+
+        return _track
+
+    def slowest_files(self):
+        """Return (ms, path) of the slowest files read, slowest first."""
+        return sorted(self._files, reverse=True)
+
+    def to_dict(self) -> dict:
+        """Return timings as a JSON serialisable dict."""
+        return {
+            'phases': {
+                x: {
+                    'ms': round(y['ms'], 3),
+                    'bytes_read': y['bytes_read']
+                }
+                for x, y in self.phases.items()
+            },
+            'total_ms': round(sum(x['ms'] for x in self.phases.values()), 3),
+            'counters': dict(self.counters),
+            'slowest_files': [{
+                'path': y,
+                'ms': round(x, 3)
+            } for x, y in self.slowest_files()],
+        }
+
+    def report(self) -> str:
+        """Return timings as a table."""
+        lines = [f'{"phase":<10} {"ms":>10} {"KiB read":>10}']
+
+        for name, totals in self.phases.items():
+            lines.append(f'{name:<10} {totals["ms"]:10.1f} '
+                         f'{totals["bytes_read"] // 1024:10d}')
+
+        total = sum(x['ms'] for x in self.phases.values())
+        lines.append(f'{"total":<10} {total:10.1f}')
+        lines.append(', '.join(f'{x}: {y}' for x, y in self.counters.items()))
+
+        if self._files:
+            lines.append('slowest files:')
+            lines.extend(f'{x:10.2f} ms  {y}' for x, y in self.slowest_files())
+
+        return '\n'.join(lines)
+
+    def write_json(self, path: Path) -> None:
+        """Write timings to a JSON file."""
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2) + '\n',
+                              encoding='utf-8')
+
+    def dump_profile(self, path: Path) -> None:
+        """Write profile stats of the profiled phase for pstats."""
+        if self.profiler:
+            self.profiler.dump_stats(str(path))
+
+
+def phase(timings: Optional[Timings], name: str):
+    """Return a timing context for name, or a no-op one without timings."""
+    return timings.phase(name) if timings else contextlib.nullcontext()
@@ -1,24 +1,328 @@
 """Utility Functions."""
+import hashlib
+import os
+import re
 import string
+import tempfile
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
+import nanoid
 
-def get_title(path: Path) -> str:
-    """Extract title from note."""
-    found_line = False
+ADORNMENT_CHARS = frozenset(string.punctuation)
+TITLE_MAX_BYTES = 16 * 1024
 
-    with path.open(encoding="utf-8") as fd_in:
+NANOID_ALPHABET = '-0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+NANOID_SIZE = 10
 
-        for line in fd_in.readlines():
-            if "=======" in line:  # pylint: disable=no-else-continue
-                found_line = True
+FIELD_RE = re.compile(r':([^:\s][^:]*):(?:\s+(.*))?$')
+
+
+def _read_umask() -> int:
+    """Return the umask of the process without leaving it changed."""
+    umask = os.umask(0)
+    os.umask(umask)
+
+    return umask
+
+
+# Read once on import, changing the umask while threads run is unsafe.
+UMASK = _read_umask()
+
+
+class TitleNotFoundError(ValueError):
+    """Note has no section title within the bytes read."""
+
+
+def _is_adornment(line: str) -> bool:
+    """Return True if line is a section adornment."""
+    return (len(line) > 1 and line[0] in ADORNMENT_CHARS
+            and line == line[0] * len(line))
+
+
+def _is_text(line: str) -> bool:
+    """Return True if line can be an underlined section title."""
+    return bool(line) and not line[0].isspace() and not line.startswith('..')
+
+
+def _is_underline(text: str, line: str) -> bool:
+    """Return True if line is a valid underline for text."""
+    return _is_adornment(line) and (len(line) >= len(text) or len(line) > 3)
+
+
+def read_lines(path: Path, max_bytes: Optional[int] = TITLE_MAX_BYTES):
+    """Yield rstripped lines from the head of a note.
+
+    Reading stops after max_bytes bytes, or at the end of the file when
+    max_bytes is None.
+    """
+    remaining = max_bytes
+
+    with path.open(mode='rb') as fd_in:
+        while remaining is None or remaining > 0:
+            line = fd_in.readline(-1 if remaining is None else remaining)
+
+            if not line:
+                return
+
+            errors = 'strict'
+
+            if remaining is not None:
+                remaining -= len(line)
+
+                if not remaining:
+                    # the cap may split a multi-byte character
+                    errors = 'ignore'
+
+            yield line.decode('utf-8', errors).rstrip().lstrip('\ufeff')
+
+
+def find_title(lines) -> Optional[str]:
+    """Return the first section title in lines."""
+    prev = ''
+    overline = None
+    text = None
+
+    for line in lines:
+        if overline:
+            if text is None:
+                text = line.strip()
+                prev = line
                 continue
 
-            elif found_line:
-                title = line.strip()
-                break
+            if line == overline and text:
+                return text
+
+            overline, text = None, None
+
+        if _is_adornment(line):
+            if _is_text(prev) and _is_underline(prev, line):
+                return prev.strip()
+
+            if not prev:
+                overline = line
+
+        prev = line
+
+    return None
+
+
+def _add_field(fields: Dict[str, str], name: str, value: str) -> None:
+    """Set a field, appending an indented continuation of its body."""
+    fields[name] = f'{fields.get(name, "")} {value.strip()}'.strip()
+
+
+def _leading_fields(lines: Iterable[str],
+                    fields: Dict[str, str]) -> Iterator[str]:
+    """Pass lines on, collecting a field list that starts a note.
+
+    Comments, targets and blank lines may come before the field list.
+    """
+    leading = True
+    name = None
+
+    for line in lines:
+        if leading:
+            match = FIELD_RE.match(line)
+
+            if match:
+                name = match.group(1).lower()
+                fields[name] = ''
+                _add_field(fields, name, match.group(2) or '')
+
+            elif line[:1].isspace():
+                if name:
+                    _add_field(fields, name, line)
+
+            elif line.startswith('..'):
+                name = None
+
+            elif line:
+                leading = False
+
+        yield line
+
+
+def find_fields(lines: Iterable[str]) -> Dict[str, str]:
+    """Return the field list at the start of lines, eg a docinfo block."""
+    fields = {}
+    name = None
+
+    for line in lines:
+        match = FIELD_RE.match(line)
+
+        if match:
+            name = match.group(1).lower()
+            fields[name] = ''
+            _add_field(fields, name, match.group(2) or '')
+
+        elif name and line[:1].isspace():
+            _add_field(fields, name, line)
+
+        elif line:
+            break
+
+    return fields
+
+
+def find_head(lines: Iterable[str]) -> Tuple[Optional[str], Dict[str, str]]:
+    """Return the title and fields of a note from its rstripped lines.
+
+    Fields come from a field list before the title or a docinfo block right
+    after it, field names are lower case. The title is None if lines hold
+    no section title.
+    """
+    lines = iter(lines)
+    fields = {}
+    title = find_title(_leading_fields(lines, fields))
+
+    if title is not None:
+        fields.update(find_fields(lines))
+
+    return title, fields
+
+
+def read_head(
+        path: Path,
+        *,
+        max_bytes: Optional[int] = TITLE_MAX_BYTES
+) -> Tuple[str, Dict[str, str]]:
+    """Extract the title and fields of a note in one read.
+
+    The first max_bytes of the note are read; only if they hold no title is
+    the whole file read. Pass None to read the whole file at once.
+    """
+    title, fields = find_head(read_lines(path, max_bytes))
+
+    if title is None:
+        if max_bytes is not None and path.stat().st_size > max_bytes:
+            return read_head(path, max_bytes=None)
+
+        raise TitleNotFoundError(f'no section title in {path}')
+
+    return title, fields
+
+
+def parse_head(path: Path, text: str) -> Tuple[str, Dict[str, str]]:
+    """Extract the title and fields of a note from the text of path."""
+    title, fields = find_head(
+        x.rstrip().lstrip('\ufeff') for x in text.split('\n'))
+
+    if title is None:
+        raise TitleNotFoundError(f'no section title in {path}')
+
+    return title, fields
+
+
+def get_title(path: Path, *, max_bytes: Optional[int] = TITLE_MAX_BYTES) -> str:
+    """Extract title from note.
+
+    The first max_bytes of the note are read before the rest of it; pass
+    None to read the whole file at once.
+    """
+    return read_head(path, max_bytes=max_bytes)[0]
+
+
+def _file_digest(path: Path) -> Optional[str]:
+    """Return sha256 digest of a file or None if it does not exist."""
+    digest = hashlib.sha256()
+
+    try:
+        with path.open(mode='rb') as fd_in:
+            for chunk in iter(lambda: fd_in.read(1024 * 1024), b''):
+                digest.update(chunk)
+
+    except FileNotFoundError:
+        return None
+
+    return digest.hexdigest()
+
+
+class AtomicFile:
+    """Text output written to a temporary file.
+
+    On exit the file replaces path atomically, but only if its digest
+    differs from the current content so unchanged outputs keep their mtime.
+    """
+
+    def __init__(self, path: Path):
+        """Create an output for path, opened on enter."""
+        self.path = Path(path)
+        self.changed = False
+        self.digest = None
+        self._digest = hashlib.sha256()
+        self._fd_out = None
+
+    def __enter__(self):
+        """Open the temporary file."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd_out = tempfile.NamedTemporaryFile(  # pylint: disable=consider-using-with
+            mode='w',
+            encoding='utf-8',
+            newline='',
+            dir=self.path.parent,
+            prefix=f'.{self.path.name}.',
+            suffix='.tmp',
+            delete=False)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Replace path if the content changed, discard it on error."""
+        self._fd_out.close()
+        tmp_path = Path(self._fd_out.name)
+
+        if exc_type:
+            tmp_path.unlink()
+            return False
+
+        self.digest = self._digest.hexdigest()
+        self.changed = _file_digest(self.path) != self.digest
+
+        if not self.changed:
+            tmp_path.unlink()
+            return False
+
+        try:
+            mode = self.path.stat().st_mode & 0o777
+
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+
+        tmp_path.chmod(mode)
+        os.replace(tmp_path, self.path)
+
+        return False
+
+    def write(self, text: str) -> None:
+        """Write text to the temporary file."""
+        self._fd_out.write(text)
+        self._digest.update(text.encode('utf-8'))
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    """Atomically write text to path unless the file already holds it."""
+    with AtomicFile(path) as out:
+        out.write(text)
+
+    return out.changed
+
+
+def get_cache_dir() -> Path:
+    """Return the per user cache directory."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'sphinx_notebook'
+
+
+def get_notebook_cache(kind: str, root_dir: Path) -> Path:
+    """Return the path of a per notebook cache file of a kind."""
+    key = hashlib.sha1(str(Path(root_dir).resolve()).encode()).hexdigest()
+    return get_cache_dir() / kind / f'{key}.json'
+
 
-    return title
+def get_target() -> str:
+    """Create a random target ID."""
+    return nanoid.generate(NANOID_ALPHABET, NANOID_SIZE)
 
 
 def parse_stem(stem: str) -> str:
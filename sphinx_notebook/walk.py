@@ -0,0 +1,304 @@
+"""Notebook directory walk."""
+import dataclasses
+import os
+import re
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+IGNORE_FILE = '.notebookignore'
+META_FILE = '_meta.yaml'
+
+NOTE = 'note'
+META = 'meta'
+DIR = 'dir'
+IGNORE = 'ignore'
+
+
+def _translate(pattern: str) -> str:
+    """Translate a gitignore glob into a regular expression."""
+    regex = ''
+    i = 0
+
+    while i < len(pattern):
+        char = pattern[i]
+
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+
+        if char == '*':
+            regex += '[^/]*'
+
+        elif char == '?':
+            regex += '[^/]'
+
+        elif char == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+
+            if body.startswith('!'):
+                body = '^' + body[1:]
+
+            regex += f'[{body}]'
+            i = end
+
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+
+        else:
+            regex += re.escape(char)
+
+        i += 1
+
+    return regex
+
+
+class IgnoreRules:
+    """Gitignore style rules read from .notebookignore files."""
+
+    def __init__(self, rules=()):
+        """Create rules from (base, regex, negate, dir_only) tuples."""
+        self.rules = tuple(rules)
+
+    def extend(self, base: str, lines: List[str]) -> 'IgnoreRules':
+        """Return rules with patterns relative to base appended."""
+        rules = list(self.rules)
+
+        for line in lines:
+            line = line.rstrip('\n')
+
+            if line.endswith(' ') and not line.endswith('\\ '):
+                line = line.rstrip(' ')
+
+            if not line or line.startswith('#'):
+                continue
+
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+
+            elif line.startswith('\\'):
+                line = line[1:]
+
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+
+            if not line:
+                continue
+
+            regex = _translate(line.lstrip('/'))
+
+            if '/' not in line:
+                regex = '(?:.*/)?' + regex
+
+            rules.append((base, re.compile(regex), negate, dir_only))
+
+        return IgnoreRules(rules)
+
+    def read(self, base: str, path: Path) -> 'IgnoreRules':
+        """Return rules extended by an ignore file, if it exists."""
+        try:
+            with path.open(encoding='utf-8') as fd_in:
+                return self.extend(base, fd_in.readlines())
+
+        except FileNotFoundError:
+            return self
+
+    def ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """Return True if the path relative to the notebook is ignored."""
+        ignored = False
+
+        for base, regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+
+            if base:
+                if not rel_path.startswith(base + '/'):
+                    continue
+
+                path = rel_path[len(base) + 1:]
+
+            else:
+                path = rel_path
+
+            if regex.fullmatch(path):
+                ignored = not negate
+
+        return ignored
+
+
+@dataclasses.dataclass(frozen=True)
+class WalkOptions:
+    """Files a walk of the notebook yields and their order.
+
+    Directories named filter_ or matched by an ignore file are pruned
+    before they are read, as are paths relative to the notebook in exclude.
+    With files_first, the files of a directory are yielded before those of
+    its subdirectories. With dirs, each directory read and its ignore file
+    are yielded too.
+    """
+
+    filter_: str = '_include'
+    note_pattern: str = '*.rst'
+    meta_pattern: str = META_FILE
+    ignore_file: str = IGNORE_FILE
+    exclude: FrozenSet[str] = frozenset()
+    files_first: bool = False
+    dirs: bool = False
+
+    def __post_init__(self):
+        """Make exclude a set, it may be given as any iterable."""
+        object.__setattr__(self, 'exclude', frozenset(self.exclude))
+
+    def kind(self, name: str) -> Optional[str]:
+        """Return the kind of a file yielded by a walk, None if it is not."""
+        if fnmatchcase(name, self.meta_pattern):
+            return META
+
+        if fnmatchcase(name, self.note_pattern):
+            return NOTE
+
+        if self.dirs and name == self.ignore_file:
+            return IGNORE
+
+        return None
+
+    def pruned(self, rel_path: str, rules: IgnoreRules, is_dir: bool) -> bool:
+        """Return True if a path relative to the notebook is skipped."""
+        return (rel_path.rpartition('/')[2] == self.filter_
+                or rel_path in self.exclude
+                or bool(rules.rules) and rules.ignored(rel_path, is_dir))
+
+    def read_rules(self, rules: IgnoreRules, root_dir: Path,
+                   rel_dir: str) -> IgnoreRules:
+        """Return rules extended by the ignore file of a directory."""
+        if not self.ignore_file:
+            return rules
+
+        return rules.read(rel_dir, root_dir / rel_dir / self.ignore_file)
+
+
+DEFAULT_OPTIONS = WalkOptions()
+
+
+def walk(root_dir: Path,
+         options: Optional[WalkOptions] = None,
+         *,
+         subdir: str = '',
+         recursive: bool = True) -> Iterator[Tuple[str, Path]]:
+    """Yield (kind, path) for notes and meta data in sorted path order.
+
+    subdir limits the walk to a directory relative to root_dir, applying
+    the ignore files of its ancestors. See WalkOptions for the files
+    yielded.
+    """
+    root_dir = Path(root_dir)
+    options = options or DEFAULT_OPTIONS
+
+    def _walk(rel_dir, rules):
+        dir_path = root_dir / rel_dir
+        rules = options.read_rules(rules, root_dir, rel_dir)
+
+        try:
+            with os.scandir(dir_path) as entries:
+                entries = sorted(entries, key=lambda x: x.name)
+
+        except (FileNotFoundError, NotADirectoryError):
+            return
+
+        if options.dirs:
+            yield DIR, dir_path
+
+        subdirs = []
+
+        for entry in entries:
+            rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+            is_dir = entry.is_dir() and not entry.is_symlink()
+
+            if options.pruned(rel_path, rules, is_dir):
+                continue
+
+            if is_dir:
+                subdirs.append(rel_path)
+
+                if recursive and not options.files_first:
+                    yield from _walk(rel_path, rules)
+
+            else:
+                kind = options.kind(entry.name)
+
+                if kind and (kind != NOTE or entry.is_file()):
+                    yield kind, dir_path / entry.name
+
+        if recursive and options.files_first:
+            for rel_path in subdirs:
+                yield from _walk(rel_path, rules)
+
+    rules = IgnoreRules()
+    rel_dir = ''
+
+    for part in Path(subdir).parts:
+        rules = options.read_rules(rules, root_dir, rel_dir)
+        rel_dir = f'{rel_dir}/{part}' if rel_dir else part
+
+        if options.pruned(rel_dir, rules, True):
+            return
+
+    yield from _walk(rel_dir, rules)
+
+
+def filter_paths(
+        root_dir: Path,
+        rel_paths: Iterable[str],
+        options: Optional[WalkOptions] = None
+) -> Iterator[Tuple[str, Path]]:
+    """Yield (kind, path) for notes and meta data among listed files.
+
+    rel_paths are files relative to root_dir, eg from the git index. The
+    same rules as walk are applied and the order is the same as a walk.
+    """
+    root_dir = Path(root_dir)
+    options = options or DEFAULT_OPTIONS
+    dirs = {}  # rel_dir: (rules of the directory, pruned)
+
+    def _dir(rel_dir):
+        if rel_dir not in dirs:
+            rules, pruned = IgnoreRules(), False
+
+            if rel_dir:
+                rules, pruned = _dir(rel_dir.rpartition('/')[0])
+                pruned = pruned or options.pruned(rel_dir, rules, True)
+
+            if not pruned:
+                rules = options.read_rules(rules, root_dir, rel_dir)
+
+            dirs[rel_dir] = (rules, pruned)
+
+        return dirs[rel_dir]
+
+    def _key(rel_path):
+        if options.files_first:
+            rel_dir, _, name = rel_path.rpartition('/')
+            return rel_dir.split('/'), name
+
+        return rel_path.split('/')
+
+    for rel_path in sorted(rel_paths, key=_key):
+        rel_dir, _, name = rel_path.rpartition('/')
+        rules, pruned = _dir(rel_dir)
+
+        if pruned or options.pruned(rel_path, rules, False):
+            continue
+
+        kind = options.kind(name)
+
+        if kind in (NOTE, META):
+            yield kind, root_dir / rel_path
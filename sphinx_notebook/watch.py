@@ -0,0 +1,512 @@
+"""Watch a notebook and incrementally rebuild its index."""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, Optional, Set
+
+import jinja2
+
+from . import builder, data, notebook, util, walk
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+IN_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+           | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT = struct.Struct('iIII')
+
+
+def _join(rel_dir: str, name: str) -> str:
+    return f'{rel_dir}/{name}' if rel_dir else name
+
+
+def _parent(rel_path: str) -> str:
+    parent = str(PurePosixPath(rel_path).parent)
+    return '' if parent == '.' else parent
+
+
+def _state(path: Path):
+    stat = path.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class Notebook:
+    """In memory notebook tree kept in step with file changes.
+
+    files holds the state and parsed value of notes and meta data files by
+    kind and path relative to the notebook.
+    """
+
+    def __init__(self,
+                 root_dir: Path,
+                 dst: Path,
+                 template: jinja2.Template,
+                 *,
+                 split_depth: int = 0):
+        """Create a notebook, scanned by load."""
+        self.root_dir = Path(root_dir)
+        self.build = builder.BuildOptions(template,
+                                          Path(dst),
+                                          split_depth=split_depth)
+        self.walk_options = walk.WalkOptions(exclude=builder.get_outputs(
+            self.root_dir, self.build.dst, split_depth))
+        self.files = {walk.NOTE: {}, walk.META: {}}
+        self.errors = []
+        self.tree = None
+        self._affected = None  # nodes to render, None for all
+
+    def _rel(self, path: Path) -> str:
+        return path.relative_to(self.root_dir).as_posix()
+
+    def load(self, jobs: int = 1) -> None:
+        """Scan the whole notebook with jobs threads and build its tree."""
+        paths = {walk.NOTE: [], walk.META: []}
+
+        for kind, path in walk.walk(self.root_dir, self.walk_options):
+            paths[kind].append(path)
+
+        states = {x: _state(x) for x in paths[walk.NOTE] + paths[walk.META]}
+
+        with notebook.thread_pool(jobs) as executor:
+            notes, meta_data = notebook.read_notes(
+                self.root_dir,
+                paths[walk.NOTE],
+                paths[walk.META],
+                options=notebook.ScanOptions(executor=executor))
+
+        for kind, values in ((walk.NOTE, notes), (walk.META, meta_data)):
+            self.files[kind] = {
+                self._rel(x): (states[x], y)
+                for x, y in zip(paths[kind], values)
+            }
+
+        self.tree = notebook.to_tree(notes, meta_data)
+        self._affected = None
+
+    def apply(self, rel_paths: Set[str]) -> None:
+        """Apply changed paths, relative to the notebook, to the tree."""
+        for rel_path in sorted(rel_paths):
+            if PurePosixPath(rel_path).name == walk.IGNORE_FILE:
+                rel_path = _parent(rel_path)
+
+            if (self.root_dir / rel_path).is_dir():
+                self._sync_dir(rel_path)
+
+            else:
+                self._sync_file(rel_path)
+
+    def _sync_dir(self, rel_dir: str) -> None:
+        found = {
+            self._rel(path): (kind, path)
+            for kind, path in walk.walk(
+                self.root_dir, self.walk_options, subdir=rel_dir)
+        }
+        prefix = f'{rel_dir}/' if rel_dir else ''
+
+        for key in [*self.files[walk.NOTE], *self.files[walk.META]]:
+            if key.startswith(prefix) and key not in found:
+                self._remove(key)
+
+        for key, (kind, path) in found.items():
+            self._update(kind, key, path)
+
+    def _sync_file(self, rel_path: str) -> None:
+        found = {
+            self._rel(path): (kind, path)
+            for kind, path in walk.walk(self.root_dir,
+                                        self.walk_options,
+                                        subdir=_parent(rel_path),
+                                        recursive=False)
+        }
+
+        if rel_path in found:
+            kind, path = found[rel_path]
+            self._update(kind, rel_path, path)
+            return
+
+        prefix = f'{rel_path}/'
+
+        for key in [*self.files[walk.NOTE], *self.files[walk.META]]:
+            if key == rel_path or key.startswith(prefix):
+                self._remove(key)
+
+    def _update(self, kind: str, key: str, path: Path) -> None:
+        store = self.files[kind]
+
+        try:
+            state = _state(path)
+
+            if key in store and store[key][0] == state:
+                return
+
+            if kind == walk.NOTE:
+                value = data.Note.from_path(self.root_dir, path)
+
+            else:
+                value = data.MetaData.from_yaml(self.root_dir, path)
+
+        except Exception as error:  # pylint: disable=broad-except
+            self.errors.append((path, error))
+            self._remove(key)
+            return
+
+        previous = store.get(key)
+        store[key] = (state, value)
+
+        if kind == walk.NOTE:
+            self._put_note(key, value)
+
+        elif value.cascade or (previous and previous[1].cascade):
+            self._apply_meta()
+
+        else:
+            self._put_meta(value)
+
+    def _put_note(self, key: str, note: data.Note) -> None:
+        leaf = self.tree.resolve(key)
+
+        if leaf is not None:
+            leaf.note = note
+            self._touch(leaf.parent)
+            return
+
+        new_section = self.tree.resolve(note.parent_path) is None
+        leaf = self.tree.add_note(note)
+
+        for node in leaf.path[:-1]:
+            names = [x.name for x in node.children]
+
+            if names != sorted(names):
+                node.children = sorted(node.children, key=lambda x: x.name)
+
+        if new_section or self._affected is None:
+            self._apply_meta()
+
+        self._touch(leaf.parent)
+
+    def _touch(self, node: data.Node) -> None:
+        """Render node next time, unless the whole tree is rendered."""
+        if self._affected is not None:
+            self._affected.append(node)
+
+    def _put_meta(self, meta: data.MetaData) -> None:
+        node = self.tree.resolve(meta.path)
+
+        if node is not None:
+            self._reset(node)
+            notebook.merge_meta(node, meta, self._inherited(node))
+            self._touch(node)
+
+    def _inherited(self, node: data.Node) -> dict:
+        """Return the settings cascaded to a node from its ancestors."""
+        overrides = {('' if x.path == '.' else x.path): x
+                     for _, x in self.files[walk.META].values()}
+        inherited = {}
+
+        for ancestor in node.path[:-1]:
+            path = '/'.join(x.name for x in ancestor.path[1:])
+            _, inherited = notebook.cascade_meta(overrides.get(path),
+                                                 inherited)
+
+        return inherited
+
+    def _apply_meta(self) -> None:
+        """Re-apply all meta data, for changes that cascade to subsections."""
+        for node in (self.tree, *self.tree.descendants):
+            if not node.is_leaf:
+                self._reset(node)
+
+        notebook.apply_meta(self.tree,
+                            [x for _, x in self.files[walk.META].values()])
+        self._affected = None
+
+    def _reset(self, node: data.Node) -> None:
+        for key in (*data.CASCADE_KEYS, 'meta_path'):
+            node.__dict__.pop(key, None)
+
+        if node.depth:
+            node.title = util.to_title_case(node.name)
+
+    def _remove(self, key: str) -> None:
+        if key in self.files[walk.NOTE]:
+            del self.files[walk.NOTE][key]
+            leaf = self.tree.resolve(key)
+
+            if leaf is None:
+                return
+
+            node = leaf.parent
+            leaf.parent = None
+
+            while node is not self.tree and not node.children:
+                parent = node.parent
+                node.parent = None
+                node = parent
+                self._affected = None
+
+            self._touch(node)
+
+        elif key in self.files[walk.META]:
+            _, meta = self.files[walk.META].pop(key)
+            data.MetaData.forget(self.root_dir, self.root_dir / key)
+            node = self.tree.resolve(meta.path)
+
+            if meta.cascade:
+                self._apply_meta()
+
+            elif node is not None:
+                self._reset(node)
+                notebook.merge_meta(node, None, self._inherited(node))
+                self._touch(node)
+
+    def render(self) -> Dict[Path, dict]:
+        """Render outputs affected by changes since the last render."""
+        index_meta = notebook.get_index_meta(
+            [x for _, x in self.files[walk.META].values()])
+
+        if not self.build.split_depth:
+            outputs = builder.write_index(self.tree, index_meta, self.build)
+
+        else:
+            only = None
+
+            if self._affected is not None:
+                split_depth = self.build.split_depth
+                only = list({
+                    id(x): x
+                    for x in (builder.get_shard_root(y, split_depth)
+                              for y in self._affected)
+                }.values())
+
+            outputs = builder.render_shards(self.tree,
+                                            index_meta,
+                                            self.build,
+                                            only=only)
+
+        self._affected = []
+
+        return outputs
+
+
+class PollingSource:
+    """Report changed notebook files by comparing directory snapshots."""
+
+    def __init__(self,
+                 root_dir: Path,
+                 interval: float = 1.0,
+                 exclude: Iterable[str] = ()):
+        """Take the first snapshot of the notebook."""
+        self.root_dir = Path(root_dir)
+        self.interval = interval
+        self.walk_options = walk.WalkOptions(exclude=exclude, dirs=True)
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, tuple]:
+        snapshot = {}
+
+        for kind, path in walk.walk(self.root_dir, self.walk_options):
+            if kind == walk.DIR:
+                continue
+
+            try:
+                snapshot[path.relative_to(
+                    self.root_dir).as_posix()] = _state(path)
+
+            except FileNotFoundError:
+                pass
+
+        return snapshot
+
+    def _changes(self) -> Set[str]:
+        snapshot = self._scan()
+        changed = {
+            x
+            for x in snapshot.keys() | self._snapshot.keys()
+            if snapshot.get(x) != self._snapshot.get(x)
+        }
+        self._snapshot = snapshot
+
+        return changed
+
+    def wait(self, debounce: float) -> Set[str]:
+        """Block until files change and return their relative paths."""
+        while True:
+            time.sleep(self.interval)
+            changed = self._changes()
+
+            if changed:
+                break
+
+        while True:
+            time.sleep(debounce)
+            more = self._changes()
+
+            if not more:
+                return changed
+
+            changed |= more
+
+    def close(self) -> None:
+        """Release resources."""
+
+
+class InotifySource:
+    """Report changed notebook paths using Linux inotify.
+
+    Only directories a walk of the notebook reads are watched, so ignored
+    and excluded directories are not.
+    """
+
+    def __init__(self,
+                 root_dir: Path,
+                 filter_: str = '_include',
+                 exclude: Iterable[str] = ()):
+        """Watch the directories of the notebook."""
+        self.root_dir = Path(root_dir)
+        self.walk_options = walk.WalkOptions(filter_=filter_,
+                                             exclude=exclude,
+                                             dirs=True)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._watches = {}
+        self._add_tree('')
+
+    @staticmethod
+    def available() -> bool:
+        """Return True if inotify can be used on this platform."""
+        if not sys.platform.startswith('linux'):
+            return False
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'))
+
+        except OSError:
+            return False
+
+        return hasattr(libc, 'inotify_init1')
+
+    def _add_tree(self, rel_dir: str) -> None:
+        for kind, dir_path in walk.walk(self.root_dir,
+                                        self.walk_options,
+                                        subdir=rel_dir):
+            if kind != walk.DIR:
+                continue
+
+            rel_path = dir_path.relative_to(self.root_dir).as_posix()
+            watch = self._libc.inotify_add_watch(self._fd,
+                                                 os.fsencode(dir_path),
+                                                 IN_MASK)
+
+            if watch >= 0:
+                self._watches[watch] = '' if rel_path == '.' else rel_path
+
+    def _read(self) -> Set[str]:
+        buffer = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+
+        while offset < len(buffer):
+            watch, mask, _, length = EVENT.unpack_from(buffer, offset)
+            offset += EVENT.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                changed.add('')
+                continue
+
+            if mask & IN_IGNORED:
+                self._watches.pop(watch, None)
+                continue
+
+            rel_dir = self._watches.get(watch)
+
+            if rel_dir is None:
+                continue
+
+            rel_path = _join(rel_dir, name) if name else rel_dir
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(rel_path)
+
+            elif name == walk.IGNORE_FILE:
+                self._add_tree(rel_dir)  # watch directories no longer ignored
+
+            changed.add(rel_path)
+
+        return changed
+
+    def wait(self, debounce: float) -> Set[str]:
+        """Block until files change and return their relative paths."""
+        select.select([self._fd], [], [])
+        changed = self._read()
+
+        while select.select([self._fd], [], [], debounce)[0]:
+            changed |= self._read()
+
+        return changed
+
+    def close(self) -> None:
+        """Release the inotify file descriptor."""
+        os.close(self._fd)
+
+
+def get_source(root_dir: Path,
+               *,
+               poll: bool = False,
+               interval: float = 1.0,
+               exclude: Iterable[str] = ()):
+    """Return an inotify event source, or a polling one if unavailable."""
+    if not poll and InotifySource.available():
+        return InotifySource(root_dir, exclude=exclude)
+
+    return PollingSource(root_dir, interval, exclude)
+
+
+def run(book: Notebook,
+        source,
+        *,
+        debounce: float = 0.1,
+        echo=print,
+        count: Optional[int] = None) -> None:
+    """Apply changes reported by source and re-render affected outputs."""
+    while count is None or count > 0:
+        changed = source.wait(debounce)
+        start = time.perf_counter()
+
+        book.apply(changed)
+        outputs = book.render()
+
+        for path, error in book.errors:
+            echo(f'{path}: {error}')
+
+        book.errors = []
+        elapsed = (time.perf_counter() - start) * 1000
+        written = [x for x, y in outputs.items() if y['changed']]
+        echo(f'{len(changed)} change(s), {len(written)} index file(s) '
+             f'written in {elapsed:.1f} ms')
+
+        if count is not None:
+            count -= 1
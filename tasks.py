@@ -151,12 +151,35 @@ def test_pytest(ctx):
     ctx.run('poetry run pytest')
 
 
+@task
+def bench_startup(ctx):
+    """Benchmark command start up time"""
+    ctx.run('poetry run python benchmarks/bench_startup.py')
+
+
+@task(help={'sizes': "notebook sizes, eg '1000 10000'",
+            'compare': "baseline JSON to check for regressions",
+            'output': "path to write JSON results"})
+def bench_build(ctx, sizes='1000 10000 100000', compare=None, output=None):
+    """Benchmark index builds on synthetic notebooks"""
+    args = f'--sizes {sizes}'
+
+    if compare:
+        args += f' --compare {compare}'
+
+    if output:
+        args += f' --output {output}'
+
+    ctx.run(f'poetry run python benchmarks/bench_build.py {args}')
+
+
 @task(test_pytest, test_accept)
 def test(ctx):
     """Run tests"""
 
 
-ns = Collection(build, bumpversion, clean, lint, release, test, test_pytest)
+ns = Collection(build, bumpversion, clean, lint, release, test, test_pytest,
+                bench_startup, bench_build)
 ns.add_task(format_yapf, name="format")
 ns.add_task(init_repo, name='init')
 
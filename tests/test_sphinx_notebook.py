@@ -2,9 +2,24 @@
 """Tests for `media_hoard_cli` package."""
 # pylint: disable=redefined-outer-name
 import dataclasses
+import json
+import os
+import shutil
+import subprocess
+import sys
 from pathlib import Path
 
-from sphinx_notebook import data, util
+import pytest
+from click.testing import CliRunner
+
+from sphinx_notebook import (builder, cli, data, filters, gitindex, notebook,
+                             util, walk, watch)
+from sphinx_notebook.cache import ScanCache
+from sphinx_notebook.search import SearchIndex
+from sphinx_notebook.targets import TargetIndex
+from sphinx_notebook.timings import Timings
+
+ENV = notebook.get_environment()
 
 
 def test_get_title():
@@ -17,6 +32,49 @@ def test_get_title():
     assert expected == result
 
 
+def test_get_title_adornments(tmp_path):
+    """Test extract title from over/underlined and underlined notes."""
+    path = tmp_path / 'note.rst'
+    notes = {
+        '.. _abc:\n\n#####\n Title \n#####\n': 'Title',
+        'Title\n~~~~~\n\nBody\n': 'Title',
+        '.. _abc:\n\nA\n--\n': 'A',
+        'Text\n\n----\n\nTitle\n\'\'\'\'\'\n': 'Title',
+    }
+
+    for text, expected in notes.items():
+        path.write_text(text)
+        assert expected == util.get_title(path)
+
+    path.write_text('.. ' + 'x' * 20000 + '\n\nTitle\n=====\n')
+    assert util.get_title(path) == 'Title'
+    assert util.get_title(path, max_bytes=4) == 'Title'
+
+    path.write_text('No title here.\n')
+    with pytest.raises(util.TitleNotFoundError):
+        util.get_title(path)
+
+
+def test_build_long_note(tmp_path):
+    """Test notes with a title beyond the title byte cap are built."""
+    root_dir = tmp_path / 'notebook'
+    (root_dir / 'section').mkdir(parents=True)
+    (root_dir / 'section/long.rst').write_text('.. ' + 'x' * 30000 +
+                                               '\n\nLong\n====\n')
+    dst = tmp_path / 'index.rst'
+
+    notes, _ = notebook.get_notes(
+        root_dir, options=notebook.ScanOptions(title_max_bytes=1024))
+    assert [x.title for x in notes] == ['Long']
+
+    result = CliRunner().invoke(cli.main, [
+        'build', '--title-max-bytes', '0',
+        str(root_dir), str(dst)
+    ])
+    assert result.exit_code == 0
+    assert 'Long' in dst.read_text()
+
+
 def test_parse_stem():
     """Test parse note stem."""
 
@@ -41,7 +99,11 @@ def test_meta_data():
         'header': "Test Notebook Header",
         'path': '.',
         'column_order': [],
-        'column_names': []
+        'column_names': [],
+        'table_columns': None,
+        'group_by': None,
+        'sort_by': None,
+        'cascade': []
     }
 
     meta_data = data.MetaData.from_yaml(root_dir, path)
@@ -53,7 +115,11 @@ def test_meta_data():
         'header': '',
         'path': 'cad_cam_make',
         'column_order': [],
-        'column_names': []
+        'column_names': [],
+        'table_columns': None,
+        'group_by': None,
+        'sort_by': None,
+        'cascade': []
     }
 
     meta_data = data.MetaData.from_yaml(root_dir, path)
@@ -70,4 +136,808 @@ def test_note():
     assert note.group == ''
     assert note.url == '/cad_cam_make/my_cad_note'
     assert note.title == 'My CAD Note'
-    assert note.parents == ['cad_cam_make']
+    assert note.parents == ('cad_cam_make',)
+    assert note.parents is data.Note.from_path(
+        root_dir, path).parents
+
+    for i in range(data.PARENTS_CACHE_SIZE):
+        data.intern_parents(('removed', str(i)))
+
+    assert note.parents is not data.Note.from_path(root_dir,
+                                                   path).parents
+
+
+def test_scan_cache(tmp_path):
+    """Test unchanged files are served from the scan cache."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+
+    for path in root_dir.rglob('*'):
+        os.utime(path, (0, 0))
+
+    cache = ScanCache(tmp_path / 'cache', root_dir)
+    expected = notebook.get_notes(root_dir,
+                                  options=notebook.ScanOptions(cache=cache))
+    cache.save()
+
+    assert cache.hits == 0
+    assert expected == notebook.get_notes(root_dir)
+
+    cache = ScanCache(tmp_path / 'cache', root_dir)
+    assert expected == notebook.get_notes(
+        root_dir, options=notebook.ScanOptions(cache=cache))
+    assert cache.misses == 0
+    cache.save()
+
+    note = root_dir / 'section_1/topic_1.rst'
+    note.write_text(note.read_text().replace('Topic 1', 'Topic One'))
+    os.utime(note, (1, 1))
+
+    cache = ScanCache(tmp_path / 'cache', root_dir)
+    notes, _ = notebook.get_notes(root_dir,
+                                  options=notebook.ScanOptions(cache=cache))
+
+    assert cache.misses == 1
+    assert 'Topic One' in [x.title for x in notes]
+
+
+def test_get_notes_jobs(tmp_path):
+    """Test parallel scan order and per file failures."""
+    root_dir = Path('tests/fixtures/notebook')
+
+    with notebook.thread_pool(4) as executor:
+        assert notebook.get_notes(root_dir) == notebook.get_notes(
+            root_dir, options=notebook.ScanOptions(executor=executor))
+
+    shutil.copytree(root_dir, tmp_path / 'notebook')
+    (tmp_path / 'notebook/section_1/no_title.rst').write_text('Body.\n')
+
+    with pytest.raises(notebook.ScanError) as scan_error, \
+            notebook.thread_pool(4) as executor:
+        notebook.get_notes(tmp_path / 'notebook',
+                           options=notebook.ScanOptions(executor=executor))
+
+    path, error = scan_error.value.failures[0]
+    assert path.name == 'no_title.rst'
+    assert isinstance(error, util.TitleNotFoundError)
+
+
+def test_get_notes_ignore(tmp_path):
+    """Test directories are pruned by filter and .notebookignore."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+
+    (root_dir / '_include').mkdir()
+    (root_dir / '_include/snippet.rst').write_text('Body.\n')
+    (root_dir / '_build/html').mkdir(parents=True)
+    (root_dir / '_build/html/page.rst').write_text('Body.\n')
+    (root_dir / 'section_2/.notebookignore').write_text('fiction/\n')
+    (root_dir / '.notebookignore').write_text('# build output\n/_build/\n'
+                                              'topic_*.rst\n!topic_2.rst\n')
+
+    notes, meta_data = notebook.get_notes(root_dir)
+    urls = [x.url for x in notes]
+
+    assert '/section_1/topic_1' not in urls
+    assert '/section_1/topic_2' in urls
+    assert not [x for x in urls if 'fiction' in x or x.startswith('/_')]
+    assert 'section_2/fiction' not in [x.path for x in meta_data]
+    assert urls == [
+        x.url for x in sorted(notes, key=lambda x: x.url.split('/'))
+    ]
+
+
+def test_to_tree():
+    """Test tree construction and meta data overrides."""
+    notes, meta_data = notebook.get_notes(Path('tests/fixtures/notebook'))
+    root = notebook.to_tree(notes, meta_data)
+
+    section = root.resolve('section_2/fiction/locations')
+    assert section.title == 'Locations'
+    assert section.depth == 3
+    assert [x.title for x in section.notes] == ['Subterranean']
+
+    assert root.resolve('section_2/fiction').header == \
+        'Locations from the future'
+    assert root.resolve('section_4').groups() == [
+        'Alpha', 'Charlie', 'Bravo', 'DIY'
+    ]
+    assert root.resolve('section_5') is None
+
+    note = data.Note('', 'new.rst', ['section_5', 'sub'], 'New')
+    assert root.add_note(note).parent is root.resolve('section_5/sub')
+
+
+def test_get_sections():
+    """Test sections compiled for rendering."""
+    notes, meta_data = notebook.get_notes(Path('tests/fixtures/notebook'))
+    sections = notebook.get_sections(notebook.to_tree(notes, meta_data))
+
+    assert [x.title for x in sections][:4] == [
+        'CAD/CAM/MAKE', 'Section 1', 'Section 2', 'Fiction'
+    ]
+
+    section = sections[-1]
+    assert section.columns == ['Alpha', 'Charlie', 'Bravo', 'DIY']
+    assert [[x.title if x else None for x in row] for row in section.rows] \
+        == [['Alpha Note 10', 'Charlie Note 30', 'Bravo Note 20',
+             'DIY Note 40'],
+            ['Alpha Note 11', 'Charlie Note 31', None, None]]
+
+    section = sections[1]
+    assert section.columns == []
+    assert [len(x) for x in section.rows] == [4]
+
+
+def test_render_shards(tmp_path):
+    """Test sharded index output is only rewritten when changed."""
+    notes, meta_data = notebook.get_notes(Path('tests/fixtures/notebook'))
+    root = notebook.to_tree(notes, meta_data)
+    index_meta = data.MetaData('.', title='Title')
+    dst = tmp_path / 'index.rst'
+    build = builder.BuildOptions(ENV.get_template('index.rst.jinja'),
+                                 dst,
+                                 split_depth=2)
+
+    def _written(outputs):
+        return [x for x, y in outputs.items() if y['changed']]
+
+    written = _written(
+        builder.render_shards(root, index_meta, build))
+    assert dst in written
+    assert tmp_path / 'index/section_2/fiction.rst' in written
+    assert 'index/section_2\n' in dst.read_text()
+    assert 'section_2/fiction\n' in (tmp_path /
+                                     'index/section_2.rst').read_text()
+
+    assert not _written(
+        builder.render_shards(root, index_meta, build))
+
+    (tmp_path / 'index/section_2/keep.rst').write_text('Keep\n====\n')
+    outputs = builder.render_shards(
+        root, index_meta, dataclasses.replace(build, split_depth=1))
+    assert _written(outputs) == [tmp_path / 'index/section_2.rst']
+    assert not (tmp_path / 'index/section_2/fiction.rst').exists()
+    assert (tmp_path / 'index/section_2/keep.rst').exists()
+    assert outputs[tmp_path / 'index/section_2.rst']['sources'] == [
+        'section_2/fiction/_meta.yaml',
+        'section_2/fiction/locations/subterranean.rst',
+        'section_2/real_world/locations/bunkers.rst'
+    ]
+
+
+def test_get_outputs(tmp_path):
+    """Test the shard directory is only excluded from sharded builds."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+    (root_dir / 'index').mkdir()
+    (root_dir / 'index/my_note.rst').write_text('My Note\n=======\n')
+    dst = root_dir / 'index.rst'
+    build = builder.BuildOptions(ENV.get_template('index.rst.jinja'), dst)
+    sharded = dataclasses.replace(build, split_depth=1)
+
+    assert builder.get_outputs(root_dir, dst) == ['index.rst']
+
+    builder.build_notebook(root_dir, build, echo=len)
+    assert 'index/my_note' in dst.read_text()
+
+    with pytest.raises(ValueError):
+        builder.build_notebook(root_dir, sharded, echo=len)
+
+    assert (root_dir / 'index/my_note.rst').exists()
+
+    shutil.rmtree(root_dir / 'index')
+    builder.build_notebook(root_dir, sharded, echo=len)
+    outputs = builder.get_outputs(root_dir, dst, split_depth=1)
+
+    assert 'index' in outputs
+    assert 'index/section_1.rst' in outputs
+
+
+def test_write_index(tmp_path, monkeypatch):
+    """Test index is replaced atomically only when its content changes."""
+    monkeypatch.setattr(os, 'umask', None)
+    root_dir = Path('tests/fixtures/notebook')
+    notes, meta_data = notebook.get_notes(root_dir)
+    root = notebook.to_tree(notes, meta_data)
+    index_meta = data.MetaData('.', title='Title')
+    dst = tmp_path / 'index.rst'
+    build = builder.BuildOptions(ENV.get_template('index.rst.jinja'), dst)
+    manifest = tmp_path / 'manifest.json'
+
+    outputs = builder.write_index(root, index_meta, build)
+    assert outputs[dst]['changed']
+    assert dst.stat().st_mode & 0o777 == 0o666 & ~util.UMASK
+    assert builder.write_manifest(manifest, root_dir, outputs)
+
+    os.utime(dst, (0, 0))
+    outputs = builder.write_index(root, index_meta, build)
+    assert not outputs[dst]['changed']
+    assert dst.stat().st_mtime == 0
+    assert not builder.write_manifest(manifest, root_dir, outputs)
+    assert '"section_4/_meta.yaml"' in manifest.read_text()
+
+    index_meta.title = 'New Title'
+    outputs = builder.write_index(root, index_meta, build)
+    assert outputs[dst]['changed']
+    assert sorted(x.name for x in tmp_path.iterdir()) == [
+        'index.rst', 'manifest.json'
+    ]
+
+
+def test_watch_notebook(tmp_path):
+    """Test incremental tree updates match a full rebuild."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+    template = ENV.get_template('index.rst.jinja')
+
+    book = watch.Notebook(root_dir, tmp_path / 'watch.rst', template)
+    book.load()
+    book.render()
+
+    note = root_dir / 'section_1/topic_1.rst'
+    note.write_text(note.read_text().replace('Topic 1', 'Topic One'))
+    (root_dir / 'section_2/fiction/locations/subterranean.rst').unlink()
+    (root_dir / 'section_5/sub').mkdir(parents=True)
+    (root_dir / 'section_5/sub/new.rst').write_text('New\n===\n')
+    (root_dir / 'section_5/_meta.yaml').write_text('title: Five\n')
+    (root_dir / 'section_4/_meta.yaml').unlink()
+    (root_dir / 'section_3/aaa__note.rst').write_text('AAA\n===\n')
+
+    book.apply({
+        'section_1/topic_1.rst', 'section_2/fiction/locations/subterranean.rst',
+        'section_5', 'section_4/_meta.yaml', 'section_3/aaa__note.rst'
+    })
+    outputs = book.render()
+    assert outputs[tmp_path / 'watch.rst']['changed']
+
+    notes, meta_data = notebook.get_notes(root_dir)
+    root = notebook.to_tree(notes, meta_data)
+    builder.write_index(root, notebook.get_index_meta(meta_data),
+                        builder.BuildOptions(template, tmp_path / 'build.rst'))
+
+    result = (tmp_path / 'watch.rst').read_text()
+    assert result == (tmp_path / 'build.rst').read_text()
+    assert 'Topic One' in result
+    assert 'Fiction' not in result
+    assert 'Five' in result
+
+
+def test_watch_cascade(tmp_path):
+    """Test meta data changes in watch mode keep cascaded settings."""
+    root_dir = tmp_path / 'notebook'
+    (root_dir / 'a/b').mkdir(parents=True)
+    (root_dir / 'a/_meta.yaml').write_text(
+        'column_order: [X, Y]\ncascade: [column_order]\n')
+    (root_dir / 'a/b/_meta.yaml').write_text('header: B\n')
+    (root_dir / 'a/b/x__note.rst').write_text('Note\n====\n')
+
+    book = watch.Notebook(root_dir, tmp_path / 'index.rst',
+                          ENV.get_template('index.rst.jinja'))
+    book.load()
+
+    (root_dir / 'a/b/_meta.yaml').write_text('header: Changed\n')
+    book.apply({'a/b/_meta.yaml'})
+    node = book.tree.resolve('a/b')
+
+    assert node.column_order == ['X', 'Y']
+    assert node.header == 'Changed'
+
+    (root_dir / 'a/b/_meta.yaml').unlink()
+    book.apply({'a/b/_meta.yaml'})
+
+    assert node.column_order == ['X', 'Y']
+    key = (str(root_dir), str(root_dir / 'a/b/_meta.yaml'))
+    assert key not in data._META_CACHE  # pylint: disable=protected-access
+    assert not hasattr(node, 'header')
+    assert builder.get_sources([node]) == ['a/b/x__note.rst']
+
+
+def test_watch_sources(tmp_path):
+    """Test change sources follow ignore files and excludes."""
+    root_dir = tmp_path / 'notebook'
+
+    for name in ('a', 'skip', 'out', 'a/_include'):
+        (root_dir / name).mkdir(parents=True)
+        (root_dir / name / 'note.rst').write_text('Note\n====\n')
+
+    (root_dir / '.notebookignore').write_text('skip/\n')
+
+    source = watch.PollingSource(root_dir, 0.01, exclude=['out'])
+    (root_dir / '.notebookignore').write_text('')
+    assert source.wait(0) == {'.notebookignore', 'skip/note.rst'}
+
+    if not watch.InotifySource.available():
+        return
+
+    (root_dir / '.notebookignore').write_text('skip/\n')
+    source = watch.InotifySource(root_dir, exclude=['out'])
+
+    try:
+        assert sorted(source._watches.values()) == ['', 'a']  # pylint: disable=protected-access
+
+        (root_dir / '.notebookignore').write_text('')
+        assert '.notebookignore' in source.wait(0.05)
+        assert 'skip' in source._watches.values()  # pylint: disable=protected-access
+
+    finally:
+        source.close()
+
+
+def test_sphinx_extension(tmp_path):
+    """Test the index is rendered and refreshed by the Sphinx extension."""
+    application = pytest.importorskip('sphinx.application')
+
+    src_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', src_dir)
+    (src_dir / 'conf.py').write_text("extensions = ['sphinx_notebook']\n")
+
+    def _build():
+        app = application.Sphinx(src_dir,
+                                 src_dir,
+                                 tmp_path / 'html',
+                                 tmp_path / 'doctrees',
+                                 'html',
+                                 status=None,
+                                 warning=None)
+        app.build()
+
+    _build()
+    assert 'Topic 1' in (src_dir / 'index.rst').read_text()
+
+    note = src_dir / 'section_1/topic_1.rst'
+    note.write_text(note.read_text().replace('Topic 1', 'Topic One'))
+    os.utime(note, (note.stat().st_mtime + 10, ) * 2)
+    _build()
+
+    assert 'Topic One' in (src_dir / 'index.rst').read_text()
+    assert 'Topic One' in (tmp_path / 'html/index.html').read_text()
+
+
+def test_cli_lazy_imports():
+    """Test the console script does not load template or tree modules."""
+    code = ('import sys, sphinx_notebook.cli; '
+            'print(sorted({"jinja2", "anytree", "yaml"} & set(sys.modules)))')
+    result = subprocess.run([sys.executable, '-c', code],
+                            check=True,
+                            capture_output=True,
+                            text=True)
+
+    assert result.stdout.strip() == '[]'
+
+
+def test_create_notes(tmp_path):
+    """Test batch note creation from a manifest."""
+    manifest = tmp_path / 'notes.csv'
+    manifest.write_text('path,title\n'
+                        'section_1/alpha.rst,Alpha\n'
+                        'section_2/sub/bravo.rst,\n')
+    entries = notebook.read_note_manifest(manifest)
+
+    created, skipped = notebook.create_notes(entries,
+                                             ENV.get_template,
+                                             root_dir=tmp_path)
+
+    assert [x.name for x in created] == ['alpha.rst', 'bravo.rst']
+    assert not skipped
+    assert util.get_title(created[0]) == 'Alpha'
+    assert util.get_title(created[1]) == 'New Note'
+
+    manifest = tmp_path / 'notes.yaml'
+    manifest.write_text('- path: section_1/charlie.rst\n'
+                        '- path: section_1/alpha.rst\n')
+    entries = notebook.read_note_manifest(manifest)
+
+    with pytest.raises(FileExistsError):
+        notebook.create_notes(entries, ENV.get_template, root_dir=tmp_path)
+
+    assert not (tmp_path / 'section_1/charlie.rst').exists()
+
+    created, skipped = notebook.create_notes(entries,
+                                             ENV.get_template,
+                                             root_dir=tmp_path,
+                                             skip_existing=True)
+
+    assert created == [tmp_path / 'section_1/charlie.rst']
+    assert skipped == [tmp_path / 'section_1/alpha.rst']
+
+    index = TargetIndex(tmp_path / 'targets.json', 'tests/fixtures/notebook')
+    index.refresh(Path('tests/fixtures/notebook'))
+    entries = [{'path': 'delta.rst', 'note_id': 'fsquc53dsw'}]
+
+    with pytest.raises(ValueError):
+        notebook.create_notes(entries,
+                              ENV.get_template,
+                              root_dir=tmp_path,
+                              targets=index)
+
+    assert not (tmp_path / 'delta.rst').exists()
+
+    entries = [{'path': 'echo.rst'}, {'path': 'foxtrot.rst', 'note_id': 'myid'},
+               {'path': 'golf.rst', 'note_id': 'myid'}]
+
+    with pytest.raises(ValueError, match='given twice'):
+        notebook.create_notes(entries, ENV.get_template, root_dir=tmp_path)
+
+    assert not (tmp_path / 'echo.rst').exists()
+
+    manifest.write_text('- {path: hotel.rst, title: 2024}\n')
+
+    with pytest.raises(ValueError, match='title is not a string'):
+        notebook.read_note_manifest(manifest)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.main, ['new', 'notes', '--from', str(manifest), '--root',
+                   str(tmp_path)])
+    assert result.exit_code == 1
+    assert 'note 1 title is not a string' in result.output
+
+
+def test_target_index(tmp_path, monkeypatch):
+    """Test the notebook target index."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree(Path('tests/fixtures/notebook'), root_dir)
+    (root_dir / 'extra.rst').write_text('.. _OC5XiMoh9U:\n\n'
+                                        'Extra\n=====\n\n'
+                                        '.. _second target:\n')
+
+    index = TargetIndex(tmp_path / 'targets.json', root_dir)
+    notebook.get_notes(root_dir, options=notebook.ScanOptions(targets=index))
+    index.save()
+
+    assert index.lookup('oc5ximoh9u') == [
+        ('extra.rst', 1), ('section_3/cheatsheets__note_10.rst', 1)
+    ]
+    assert index.lookup('Second  Target') == [('extra.rst', 6)]
+    assert list(index.duplicates()) == ['oc5ximoh9u']
+
+    index = TargetIndex.load(tmp_path / 'targets.json', root_dir)
+    assert index.lookup('second target') == [('extra.rst', 6)]
+
+    (root_dir / 'extra.rst').unlink()
+    index.refresh(root_dir)
+    assert not index.lookup('second target')
+    assert not index.duplicates()
+
+    labels = iter(['OC5XiMoh9U', 'oc5ximoh9u', 'NewTarget1'])
+    monkeypatch.setattr(util, 'get_target', lambda: next(labels))
+    assert index.new_target() == 'NewTarget1'
+
+
+def test_apply_meta(tmp_path):
+    """Test meta data validation and cascading settings."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+
+    (root_dir / 'section_2/_meta.yaml').write_text(
+        'column_order: [Alpha]\ncascade: [column_order]\n')
+    (root_dir / 'section_2/fiction/locations/_meta.yaml').write_text(
+        'title: Places\n')
+
+    root = notebook.to_tree(*notebook.get_notes(root_dir))
+
+    assert root.resolve('section_2/fiction').column_order == ['Alpha']
+    assert root.resolve('section_2/fiction').header == \
+        'Locations from the future'
+    assert root.resolve('section_2/fiction/locations').column_order == \
+        ['Alpha']
+    assert root.resolve('section_2/fiction/locations').title == 'Places'
+    assert not hasattr(root.resolve('section_1'), 'column_order')
+
+    sources = builder.get_sources(
+        [root.resolve('section_2/real_world'),
+         root.resolve('section_2/fiction')])
+    assert 'section_2/fiction/_meta.yaml' in sources
+    assert 'section_2/real_world/_meta.yaml' not in sources
+
+    (root_dir / 'section_1/_meta.yaml').write_text('colum_order: [Alpha]\n')
+
+    with pytest.raises(notebook.ScanError) as scan_error:
+        notebook.get_notes(root_dir)
+
+    assert isinstance(scan_error.value.failures[0][1], data.MetaDataError)
+
+
+def test_timings(tmp_path):
+    """Test per phase build instrumentation."""
+    timings = Timings(slowest=2, profile='render')
+    notes, meta_data = notebook.get_notes(
+        Path('tests/fixtures/notebook'),
+        options=notebook.ScanOptions(timings=timings))
+    builder.write_index(notebook.to_tree(notes, meta_data),
+                        data.MetaData('.', title='Title'),
+                        builder.BuildOptions(
+                            ENV.get_template('index.rst.jinja'),
+                            tmp_path / 'index.rst'),
+                        timings=timings)
+
+    assert list(timings.phases) == ['walk', 'notes', 'meta', 'render', 'write']
+    assert timings.counters['files_visited'] == len(notes) + len(meta_data)
+    assert len(timings.slowest_files()) == 2
+
+    timings.write_json(tmp_path / 'timings.json')
+    timings.dump_profile(tmp_path / 'render.prof')
+    assert (tmp_path / 'render.prof').exists()
+
+
+def test_search_index(tmp_path):
+    """Test the notebook search index."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+
+    index = SearchIndex(tmp_path / 'search.json', root_dir, body=True)
+    notebook.get_notes(root_dir, options=notebook.ScanOptions(search=index))
+    index.save()
+
+    index = SearchIndex.load(tmp_path / 'search.json', root_dir)
+    assert index.body
+    assert index.search('my cad')[0][1] == 'cad_cam_make/my_cad_note.rst'
+    assert [x for _, x in index.search('subterr')] == \
+        ['section_2/fiction/locations/subterranean.rst']
+    assert not index.search('cad nosuchword')
+
+    note = root_dir / 'section_1/topic_1.rst'
+    note.write_text(note.read_text().replace('Topic 1', 'Zebra Crossing'))
+    (root_dir / 'cad_cam_make/my_cad_note.rst').unlink()
+    index.refresh(root_dir)
+
+    assert [x for _, x in index.search('zebra')] == ['section_1/topic_1.rst']
+    assert not index.search('my cad')
+
+
+def test_table_body():
+    """Test column bucketing of non contiguous and unordered groups."""
+    section = data.Node('section', title='Section')
+
+    for name in ['b__1.rst', 'a__1.rst', 'plain.rst', 'b__2.rst', 'c__1.rst']:
+        group = util.parse_stem(name[:-4]).capitalize()
+        section.append_note(data.Note(group, name, ['section'], name))
+
+    assert filters.table_header(section) == ['A', 'B', 'C', 'Other']
+    assert [[x.name if x else None for x in row]
+            for row in filters.table_body(section)] == [
+                ['a__1.rst', 'b__1.rst', 'c__1.rst', 'plain.rst'],
+                [None, 'b__2.rst', None, None]]
+
+    section.update({'column_order': ['C', 'B'], 'column_names': [['', '-']]})
+    assert filters.table_header(section) == ['C', 'B', 'A', '-']
+
+    section = data.Node('section', title='Section', table_columns=2)
+
+    for name in ['x.rst', 'y.rst', 'z.rst']:
+        section.append_note(data.Note('', name, ['section'], name))
+
+    assert [len(x) for x in filters.table_body(section)] == [2, 2]
+    assert [len(x) for x in filters.table_body(section, 3)] == [3]
+
+
+def test_build_config(tmp_path):
+    """Test building several notebooks in one run."""
+    for name in ('a', 'b'):
+        shutil.copytree('tests/fixtures/notebook', tmp_path / name)
+
+    (tmp_path / 'b/section_1/bad.rst').write_text('Body.\n')
+    (tmp_path / 'notebooks.yaml').write_text(
+        'defaults:\n  split_depth: 1\n'
+        'notebooks:\n'
+        '  - {src: a, dst: out/a/index.rst, manifest: out/a.json}\n'
+        '  - {src: b, dst: out/b/index.rst}\n')
+
+    result = CliRunner().invoke(
+        cli.main,
+        ['build', '--config',
+         str(tmp_path / 'notebooks.yaml'), '-j', '2'])
+
+    assert result.exit_code == 1
+    assert (tmp_path / 'out/a/index/section_1.rst').exists()
+    assert (tmp_path / 'out/a.json').exists()
+    assert not (tmp_path / 'out/b').exists()
+
+
+@pytest.mark.skipif(not shutil.which('git'), reason='git is not installed')
+def test_get_notes_git(tmp_path):
+    """Test listing notes from the git index."""
+    root_dir = tmp_path / 'repo/notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+    expected = notebook.get_notes(root_dir)
+
+    assert notebook.get_notes(
+        root_dir, options=notebook.ScanOptions(git=True)) == expected
+
+    subprocess.run(['git', 'init', '-q', str(tmp_path / 'repo')], check=True)
+    subprocess.run(['git', 'add', '.'], cwd=root_dir, check=True)
+
+    assert notebook.get_notes(
+        root_dir, options=notebook.ScanOptions(git=True)) == expected
+
+    listing = gitindex.parse_index(root_dir)
+    assert listing.keys() == gitindex.ls_files(root_dir).keys()
+
+    config = tmp_path / 'repo/.git/config'
+    config.write_text(config.read_text() + '[remote "origin"]\n'
+                      '\turl = https://example.com/sha256-tools/notes.git\n')
+    assert gitindex.parse_index(root_dir).keys() == listing.keys()
+
+    config.write_text(config.read_text() +
+                      '[extensions]\n\tobjectFormat = sha256\n')
+    assert gitindex.get_hash_size(tmp_path / 'repo/.git') == 32
+
+    with pytest.raises(ValueError):
+        gitindex.parse_index(root_dir)
+
+    config.write_text(config.read_text().replace('sha256\n', 'sha1\n'))
+
+    cache = ScanCache(tmp_path / 'cache', root_dir)
+    notebook.get_notes(root_dir,
+                       options=notebook.ScanOptions(cache=cache, git=True))
+    cache.save()
+
+    note = root_dir / 'section_1/topic_1.rst'
+    note.write_text(note.read_text().replace('Topic 1', 'Changed'))
+    (root_dir / 'new.rst').write_text('New\n===\n')
+
+    cache = ScanCache(tmp_path / 'cache', root_dir)
+    notes, _ = notebook.get_notes(
+        root_dir, options=notebook.ScanOptions(cache=cache, git=True))
+
+    assert 'Changed' in [x.title for x in notes]
+    assert 'New' in [x.title for x in notes]
+    assert cache.misses == 2
+
+    (root_dir / 'section_4/diy__note_40.rst').unlink()
+    notes, _ = notebook.get_notes(root_dir,
+                                  options=notebook.ScanOptions(git=True))
+
+    assert 'diy__note_40.rst' not in [x.name for x in notes]
+    assert 'section_4/diy__note_40.rst' not in gitindex.parse_index(
+        root_dir).paths
+
+
+def test_build_only(tmp_path):
+    """Test splicing a rebuilt section into the existing index."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+    template = ENV.get_template('index.rst.jinja')
+    dst = tmp_path / 'index.rst'
+    build = builder.BuildOptions(template, dst)
+    cache = ScanCache(tmp_path / 'cache', root_dir)
+    builder.build_notebook(root_dir,
+                           build,
+                           notebook.ScanOptions(cache=cache),
+                           echo=len)
+
+    for path in ('section_1/topic_1.rst',
+                 'section_2/fiction/locations/subterranean.rst'):
+        note = root_dir / path
+        title = util.get_title(note)
+        note.write_text(note.read_text().replace(title, f'{title} Edited'))
+
+    cache = ScanCache(tmp_path / 'cache', root_dir)
+    builder.build_notebook(root_dir,
+                           build,
+                           notebook.ScanOptions(cache=cache),
+                           only='section_2/fiction',
+                           echo=len)
+    assert cache.misses == 1
+    assert dst.read_text().count('Edited') == 1
+
+    cache = ScanCache(tmp_path / 'cache', root_dir)
+    builder.build_notebook(root_dir,
+                           build,
+                           notebook.ScanOptions(cache=cache),
+                           echo=len)
+    assert cache.misses == 2  # just edited, entries of other notes are kept
+
+    builder.build_notebook(root_dir,
+                           builder.BuildOptions(template,
+                                                tmp_path / 'full.rst'),
+                           echo=len)
+    assert dst.read_text() == (tmp_path / 'full.rst').read_text()
+
+    with pytest.raises(ValueError):
+        builder.build_notebook(root_dir,
+                               builder.BuildOptions(template,
+                                                    tmp_path / 'missing.rst'),
+                               only='section_1',
+                               echo=len)
+
+
+def test_stream_index(tmp_path):
+    """Test a streamed index matches one rendered from the whole tree."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+    template = ENV.get_template('index.rst.jinja')
+    notes, meta_data = notebook.get_notes(root_dir)
+    expected = builder.write_index(
+        notebook.to_tree(notes, meta_data),
+        notebook.get_index_meta(meta_data),
+        builder.BuildOptions(template, tmp_path / 'tree.rst'))
+    dst = tmp_path / 'index.rst'
+    build = builder.BuildOptions(template, dst)
+
+    with notebook.thread_pool(2) as executor:
+        outputs = builder.stream_index(
+            root_dir, build, notebook.ScanOptions(executor=executor))
+
+    assert dst.read_text() == (tmp_path / 'tree.rst').read_text()
+    assert outputs[dst]['sources'] == expected[tmp_path / 'tree.rst']['sources']
+
+    (root_dir / 'section_2/fiction/bad.rst').write_text('Body.\n')
+
+    with pytest.raises(notebook.ScanError):
+        builder.stream_index(root_dir, build)
+
+    assert dst.read_text() == (tmp_path / 'tree.rst').read_text()
+    assert sorted(x.name for x in tmp_path.iterdir()) == [
+        'index.rst', 'notebook', 'tree.rst'
+    ]
+
+
+def test_check(tmp_path):
+    """Test checking references and targets."""
+    root_dir = tmp_path / 'notebook'
+    shutil.copytree('tests/fixtures/notebook', root_dir)
+    (root_dir / 'section_1/links.rst').write_text(
+        '.. _OC5XiMoh9U:\n\nLinks\n=====\n\n'
+        'See :doc:`topic_1`, :doc:`Two </section_1/topic_2>`, '
+        ':ref:`m9xa50d3km` and :ref:`genindex`.\n\n'
+        'Broken :doc:`../missing` and\n:ref:`Gone <no-such-label>`.\n'
+        'Wrapped :doc:`missing\n document </nowhere/at_all>`, :ref:`no such\n'
+        '  label` and :ref:`Found\n <m9xa50d3km>`.\n')
+
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ['check', str(root_dir)])
+    assert result.exit_code == 1
+    assert 'section_1/links.rst:8: unknown document ../missing' in result.output
+    assert 'section_1/links.rst:9: unknown target no-such-label' in result.output
+    assert ('section_1/links.rst:10: unknown document /nowhere/at_all'
+            in result.output)
+    assert 'section_1/links.rst:11: unknown target no such label' in result.output
+    assert 'duplicate target oc5ximoh9u' in result.output
+
+    result = runner.invoke(cli.main, ['check', '--json', '-j', '2',
+                                      str(root_dir)])
+    report = json.loads(result.stdout)
+    assert report['references'] == 28  # 19 from the index
+    assert len(report['dangling']) == 4
+
+    (root_dir / 'section_1/links.rst').unlink()
+    result = runner.invoke(cli.main, ['check', str(root_dir)])
+    assert result.exit_code == 0
+
+
+def test_note_fields(tmp_path):
+    """Test reading note fields and grouping and sorting by them."""
+    section = tmp_path / 'section'
+    section.mkdir()
+    notes = {
+        'a.rst': ':tags: x,\n   y\n\n.. _a:\n\nA\n===\n\n:status: done\n'
+        ':date: 2024-02-01\n\nBody :not: a field.\n',
+        'b.rst': 'B\n===\n\n:status: draft\n:date: 2024-03-01\n',
+        'c.rst': '===\nC\n===\n\nText.\n\n:status: late\n',
+    }
+
+    for name, text in notes.items():
+        (section / name).write_text(text)
+
+    note = data.Note.from_path(tmp_path, section / 'a.rst')
+    assert note.fields == {'tags': 'x, y', 'status': 'done', 'date': '2024-02-01'}
+    assert not data.Note.from_path(tmp_path, section / 'c.rst').fields
+
+    cache = ScanCache(tmp_path / 'cache', tmp_path)
+    assert cache.note(tmp_path, section / 'a.rst') == note
+
+    (section / '_meta.yaml').write_text('group_by: status\nsort_by: -date\n')
+    notes, meta_data = notebook.get_notes(tmp_path,
+                                          walk.WalkOptions(exclude=['cache']))
+    node = notebook.to_tree(notes, meta_data).resolve('section')
+    result = data.Section.from_node(node)
+
+    assert result.columns == ['done', 'draft', 'Other']
+    assert [[x and x.name for x in row] for row in result.rows] == [
+        ['a.rst', 'b.rst', 'c.rst']
+    ]
+    assert [x.name for x in data.sort_notes(node.notes, '-date')] == [
+        'b.rst', 'a.rst', 'c.rst'
+    ]